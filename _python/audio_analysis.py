@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+"""
+Offline Audio Analysis
+----------------------
+Measures every track on the card once and stores the results in the track
+metadata cache (see metadata_cache.py), next to the parsed tags:
+- RMS loudness and peak level (dBFS), and the crest factor between them
+- A tempo estimate (BPM) from the autocorrelation of an onset envelope
+- An energy score (0.1-1.0) combining loudness, tempo and crest factor,
+  which the playlist generator uses for its flow curve
+
+Tracks are decoded by ffmpeg to mono 16-bit PCM at a reduced sample rate and
+read from its pipe in fixed-size chunks; each chunk is reduced to per-frame
+energies with NumPy, so a whole file is never held in memory. Tracks are
+analysed in a process pool.
+
+Results are keyed by path, size and mtime, so later runs only analyse tracks
+that are new or changed. Set the number of worker processes with the
+SP3000_ANALYSIS_WORKERS environment variable.
+
+Usage: python audio_analysis.py <mount_directory>
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from card_inventory import iter_dirs, load_card_inventory
+from metadata_cache import MetadataCache
+
+# Configuration
+ANALYSIS_WORKERS = int(os.environ.get("SP3000_ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+ANALYSIS_VERSION = 1  # Bump to re-analyse every track after changing the measurements
+ANALYSIS_SAMPLE_RATE = 22050
+FRAME_SIZE = 512  # Samples per energy frame (about 23ms)
+CHUNK_FRAMES = 2048  # Frames read from ffmpeg at a time (2MB of PCM)
+TEMPO_RANGE = (60, 180)  # BPM range searched by the tempo estimate
+MUSIC_EXTENSIONS = ('.flac', '.mp3', '.wav', '.aiff', '.alac', '.ape', '.dsf', '.dff')
+
+def list_card_tracks(mount_dir):
+    """Return (path, size, mtime_ns) for every music file on the card, from the card inventory"""
+    inventory = load_card_inventory(mount_dir)
+    tracks = []
+    for top in ("Music/CD", "Music/Hires"):
+        for root, files in iter_dirs(inventory, top, mount_dir):
+            for name in sorted(files):
+                if name.lower().endswith(MUSIC_EXTENSIONS):
+                    size, mtime_ns = files[name]
+                    tracks.append((os.path.join(root, name), size, mtime_ns))
+    return tracks
+
+def _decode_command(path):
+    return ['ffmpeg', '-v', 'error', '-nostdin', '-i', path,
+            '-f', 's16le', '-ac', '1', '-ar', str(ANALYSIS_SAMPLE_RATE), '-']
+
+def estimate_tempo(frame_energies):
+    """Estimate the tempo in BPM from per-frame energies, or 0 if there is no clear pulse"""
+    if len(frame_energies) < 4:
+        return 0.0
+    # Onset envelope: rises in log energy between frames
+    log_energy = np.log10(frame_energies + 1e-10)
+    onset = np.maximum(np.diff(log_energy), 0)
+    onset -= onset.mean()
+    if not onset.any():
+        return 0.0
+
+    # Autocorrelation through the FFT, zero-padded to avoid wrap-around
+    size = 1 << (2 * len(onset) - 1).bit_length()
+    spectrum = np.fft.rfft(onset, size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(onset)]
+
+    frame_rate = ANALYSIS_SAMPLE_RATE / FRAME_SIZE
+    min_lag = int(60 * frame_rate / TEMPO_RANGE[1])
+    max_lag = min(int(60 * frame_rate / TEMPO_RANGE[0]) + 1, len(autocorr))
+    if max_lag <= min_lag:
+        return 0.0
+    lag = min_lag + int(np.argmax(autocorr[min_lag:max_lag]))
+    if autocorr[lag] <= 0:
+        return 0.0
+    # A pulse also correlates at twice its period: prefer the faster tempo
+    # when the half lag is nearly as strong. Peaks are compared over three
+    # lags because a period between two frames splits its peak.
+    half = round(lag / 2)
+    if half - 1 >= min_lag:
+        strength = autocorr[lag - 1:lag + 2].sum()
+        if autocorr[half - 1:half + 2].sum() >= 0.8 * strength:
+            lag = half - 1 + int(np.argmax(autocorr[half - 1:half + 2]))
+
+    # Refine the peak between frames with a parabola through its neighbours
+    if min_lag < lag < len(autocorr) - 1:
+        before, peak, after = autocorr[lag - 1:lag + 2]
+        curvature = before - 2 * peak + after
+        if curvature < 0:
+            return 60 * frame_rate / (lag + 0.5 * (before - after) / curvature)
+    return 60 * frame_rate / lag
+
+def energy_score(rms_db, crest_db, tempo):
+    """Combine loudness, crest factor and tempo into an energy between 0.1 and 1.0"""
+    loudness = np.clip((rms_db + 35) / 25, 0, 1)  # -35 dBFS quiet, -10 dBFS loud
+    compression = np.clip((20 - crest_db) / 14, 0, 1)  # Dense masters have a low crest factor
+    pace = np.clip((tempo - 60) / 120, 0, 1) if tempo else 0.5
+    return float(np.clip(0.5 * loudness + 0.2 * compression + 0.3 * pace, 0.1, 1.0))
+
+def analyze_track(path):
+    """Measure one track by streaming its PCM from ffmpeg, returning a features dict or None"""
+    frame_bytes = FRAME_SIZE * 2
+    chunk_bytes = CHUNK_FRAMES * frame_bytes
+    sum_squares = 0.0
+    sample_count = 0
+    peak = 0.0
+    frame_energies = []
+    pending = b''
+
+    try:
+        proc = subprocess.Popen(_decode_command(path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+    with proc.stdout:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            # Keep whole frames; a partial frame waits for the next read
+            data = pending + data
+            usable = len(data) - len(data) % frame_bytes
+            pending = data[usable:]
+            if not usable:
+                continue
+            samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768.0
+            frames = samples.reshape(-1, FRAME_SIZE)
+            energies = np.einsum('ij,ij->i', frames, frames)
+            sum_squares += float(energies.sum())
+            sample_count += samples.size
+            peak = max(peak, float(np.abs(samples).max()))
+            frame_energies.append(energies / FRAME_SIZE)
+    if proc.wait() != 0 or sample_count == 0:
+        return None
+
+    rms = np.sqrt(sum_squares / sample_count)
+    rms_db = 20 * np.log10(max(rms, 1e-6))
+    peak_db = 20 * np.log10(max(peak, 1e-6))
+    crest_db = peak_db - rms_db
+    tempo = estimate_tempo(np.concatenate(frame_energies))
+    return {
+        'version': ANALYSIS_VERSION,
+        'rms_db': round(float(rms_db), 2),
+        'peak_db': round(float(peak_db), 2),
+        'crest_db': round(float(crest_db), 2),
+        'tempo': round(float(tempo), 1),
+        'energy': round(energy_score(rms_db, crest_db, tempo), 3),
+        'duration': round(sample_count / ANALYSIS_SAMPLE_RATE, 2),
+    }
+
+def analyze_tracks(tracks, metadata_cache, workers=None):
+    """Analyse the tracks without current results, returning (analysed, cached, failed) counts"""
+    stored = metadata_cache.get_all_features(tracks)
+    pending = [(path, size, mtime_ns) for path, size, mtime_ns in tracks
+               if stored.get(path, {}).get('version') != ANALYSIS_VERSION]
+    cached = len(tracks) - len(pending)
+    print(f"{cached} tracks already analysed, {len(pending)} to analyse")
+    if not pending:
+        return 0, cached, 0
+
+    workers = max(1, min(workers or ANALYSIS_WORKERS, len(pending)))
+    analysed = 0
+    failed = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_track, path): (path, size, mtime_ns)
+                   for path, size, mtime_ns in pending}
+        for future in as_completed(futures):
+            path, size, mtime_ns = futures[future]
+            error = ''
+            try:
+                features = future.result()
+            except BrokenProcessPool as e:
+                # The worker died, not necessarily because of this track: retry it next run
+                print(f"Warning: Could not analyse {path}: {e}")
+                failed += 1
+                continue
+            except Exception as e:
+                # An unexpected error in one track must not abort the batch
+                features = None
+                error = f": {e}"
+            if features is None:
+                # Recorded so the track is not retried until it changes
+                print(f"Warning: Could not analyse {path}{error}")
+                features = {'version': ANALYSIS_VERSION, 'error': True}
+                failed += 1
+            else:
+                analysed += 1
+            metadata_cache.set_features(path, size, mtime_ns, features)
+            done = analysed + failed
+            if done % 100 == 0:
+                print(f"  Analysed {done} of {len(pending)} tracks ({time.time() - start:.0f}s)")
+
+    print(f"Analysed {analysed} tracks with {workers} processes in {time.time() - start:.1f}s "
+          f"({failed} failed)")
+    return analysed, cached, failed
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python audio_analysis.py <mount_directory>")
+        sys.exit(1)
+
+    mount_dir = sys.argv[1]
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+    if shutil.which('ffmpeg') is None:
+        print("Error: ffmpeg is required for audio analysis")
+        sys.exit(1)
+
+    tracks = list_card_tracks(mount_dir)
+    print(f"Found {len(tracks)} music tracks on SDXC card")
+
+    metadata_cache = MetadataCache()
+    try:
+        analyze_tracks(tracks, metadata_cache)
+    finally:
+        metadata_cache.close()
+
+if __name__ == "__main__":
+    main()
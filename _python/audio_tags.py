@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Lightweight Audio Tag Reader
+----------------------------
+Reads track metadata straight from the file headers without decoding audio
+and without any third-party tag library:
+- FLAC: the STREAMINFO and VORBIS_COMMENT metadata blocks (other blocks such
+  as embedded pictures are skipped with a seek, not read)
+- DSF: the fmt chunk and the ID3v2.2/2.3/2.4 tag the header points to (only
+  the text frames that are needed are read)
+
+Usually only a few KB are read per file, so a whole card can be tagged in a
+thread pool at a small fraction of the I/O of reading the audio.
+
+Returned tags (missing values are left out):
+    artist, album, album_artist, title, genre, date, track_number,
+    duration, sample_rate, bit_depth, channels
+
+Usage: python audio_tags.py <audio_file> [<audio_file> ...]
+"""
+
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Configuration
+TAG_READ_WORKERS = int(os.environ.get("SP3000_TAG_WORKERS", "8"))
+
+# Vorbis comment fields and ID3v2 frames mapped to tag names
+VORBIS_FIELDS = {
+    'ARTIST': 'artist',
+    'ALBUM': 'album',
+    'ALBUMARTIST': 'album_artist',
+    'ALBUM ARTIST': 'album_artist',
+    'TITLE': 'title',
+    'GENRE': 'genre',
+    'DATE': 'date',
+    'TRACKNUMBER': 'track_number',
+}
+ID3_FRAMES = {
+    'TPE1': 'artist',
+    'TALB': 'album',
+    'TPE2': 'album_artist',
+    'TIT2': 'title',
+    'TCON': 'genre',
+    'TDRC': 'date',
+    'TYER': 'date',
+    'TRCK': 'track_number',
+}
+# ID3v2.2 uses three-character frame IDs
+ID3V22_FRAMES = {
+    'TP1': 'artist',
+    'TAL': 'album',
+    'TP2': 'album_artist',
+    'TT2': 'title',
+    'TCO': 'genre',
+    'TYE': 'date',
+    'TRK': 'track_number',
+}
+ID3_TEXT_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+def parse_track_number(value):
+    """Turn '3', '03' or '3/12' into an int (0 if not a number)"""
+    try:
+        return int(str(value).split('/')[0].strip())
+    except ValueError:
+        return 0
+
+def _read_exact(f, size):
+    """Read exactly size bytes or raise ValueError"""
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of file")
+    return data
+
+def _parse_streaminfo(data, tags):
+    """Fill sample rate, bit depth, channels and duration from a STREAMINFO block"""
+    # Bytes 10-17: sample rate (20 bits), channels - 1 (3 bits),
+    # bits per sample - 1 (5 bits), total samples (36 bits)
+    packed = int.from_bytes(data[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bit_depth = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if sample_rate:
+        tags['sample_rate'] = sample_rate
+        tags['bit_depth'] = bit_depth
+        tags['channels'] = channels
+        if total_samples:
+            tags['duration'] = total_samples / sample_rate
+
+def _parse_vorbis_comment(data, tags):
+    """Fill text tags from a VORBIS_COMMENT block (little-endian lengths)"""
+    vendor_length = struct.unpack_from('<I', data, 0)[0]
+    offset = 4 + vendor_length
+    count = struct.unpack_from('<I', data, offset)[0]
+    offset += 4
+    for _ in range(count):
+        length = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+        comment = data[offset:offset + length].decode('utf-8', errors='replace')
+        offset += length
+        key, sep, value = comment.partition('=')
+        name = VORBIS_FIELDS.get(key.upper())
+        # Keep the first value of repeated fields
+        if sep and name and value and name not in tags:
+            tags[name] = value.strip()
+
+def read_flac_tags(path):
+    """Read STREAMINFO and VORBIS_COMMENT from a FLAC file"""
+    tags = {}
+    with open(path, 'rb') as f:
+        if _read_exact(f, 4) != b'fLaC':
+            raise ValueError("Not a FLAC file")
+        found = 0
+        while found < 2:
+            header = _read_exact(f, 4)
+            is_last = header[0] & 0x80
+            block_type = header[0] & 0x7F
+            length = int.from_bytes(header[1:4], 'big')
+            if block_type == 0:
+                _parse_streaminfo(_read_exact(f, length), tags)
+                found += 1
+            elif block_type == 4:
+                _parse_vorbis_comment(_read_exact(f, length), tags)
+                found += 1
+            else:
+                f.seek(length, os.SEEK_CUR)
+            if is_last:
+                break
+    return tags
+
+def _syncsafe(data):
+    """Decode a 4-byte ID3v2 syncsafe integer"""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def _decode_id3_text(data):
+    """Decode an ID3v2 text frame, returning the first value"""
+    if not data:
+        return ''
+    encoding = ID3_TEXT_ENCODINGS.get(data[0], 'latin-1')
+    text = data[1:].decode(encoding, errors='replace')
+    return text.split('\x00')[0].strip()
+
+def _clean_id3_genre(value):
+    """Drop ID3v1 genre references such as '(17)' when a genre name follows"""
+    if value.startswith('(') and ')' in value:
+        rest = value[value.index(')') + 1:].strip()
+        if rest:
+            return rest
+    return value
+
+def _read_id3v2(f, offset, tags):
+    """Read the wanted text frames of an ID3v2.2/2.3/2.4 tag at offset"""
+    f.seek(offset)
+    header = f.read(10)
+    if len(header) != 10 or header[:3] != b'ID3':
+        return
+    version = header[3]
+    if version not in (2, 3, 4):
+        return
+    if version == 2 and header[5] & 0x40:
+        return  # ID3v2.2 compression has no defined scheme
+    end = offset + 10 + _syncsafe(header[6:10])
+    position = offset + 10
+    if version >= 3 and header[5] & 0x40:
+        # Skip the extended header
+        ext = _read_exact(f, 4)
+        ext_size = _syncsafe(ext) if version >= 4 else struct.unpack('>I', ext)[0] + 4
+        position += ext_size
+        f.seek(position)
+
+    # ID3v2.2 frames: 3-character ID and 3-byte size; later versions: 4 and 4, plus 2 flag bytes
+    if version == 2:
+        id_length, header_length, frames = 3, 6, ID3V22_FRAMES
+    else:
+        id_length, header_length, frames = 4, 10, ID3_FRAMES
+
+    while position + header_length <= end:
+        frame_header = _read_exact(f, header_length)
+        frame_id = frame_header[:id_length].decode('latin-1')
+        if not frame_id.strip('\x00'):
+            break  # Padding
+        size_bytes = frame_header[id_length:id_length * 2]
+        if version >= 4:
+            size = _syncsafe(size_bytes)
+        else:
+            size = int.from_bytes(size_bytes, 'big')
+        position += header_length + size
+        name = frames.get(frame_id)
+        if name and name not in tags:
+            value = _decode_id3_text(_read_exact(f, size))
+            if value:
+                tags[name] = _clean_id3_genre(value) if name == 'genre' else value
+        else:
+            f.seek(size, os.SEEK_CUR)
+
+def read_dsf_tags(path):
+    """Read the fmt chunk and ID3v2 tag of a DSF file"""
+    tags = {}
+    with open(path, 'rb') as f:
+        # DSD chunk: 'DSD ', chunk size, file size, pointer to the metadata chunk
+        dsd = _read_exact(f, 28)
+        if dsd[:4] != b'DSD ':
+            raise ValueError("Not a DSF file")
+        metadata_offset = struct.unpack_from('<Q', dsd, 20)[0]
+
+        # fmt chunk: version, format id, channel type, channels, sample rate,
+        # bits per sample, sample count, block size
+        fmt = _read_exact(f, 52)
+        if fmt[:4] != b'fmt ':
+            raise ValueError("Missing DSF fmt chunk")
+        channels, sample_rate, bit_depth, sample_count = struct.unpack_from('<IIIQ', fmt, 24)
+        if sample_rate:
+            tags['sample_rate'] = sample_rate
+            tags['bit_depth'] = bit_depth
+            tags['channels'] = channels
+            tags['duration'] = sample_count / sample_rate
+
+        if metadata_offset:
+            _read_id3v2(f, metadata_offset, tags)
+    return tags
+
+def read_tags(path):
+    """Read the tags of a FLAC or DSF file, or return None if unsupported or unreadable"""
+    lower = path.lower()
+    try:
+        if lower.endswith('.flac'):
+            tags = read_flac_tags(path)
+        elif lower.endswith('.dsf'):
+            tags = read_dsf_tags(path)
+        else:
+            return None
+    except (OSError, ValueError, struct.error):
+        return None
+    if 'track_number' in tags:
+        tags['track_number'] = parse_track_number(tags['track_number'])
+    return tags
+
+def read_all_tags(paths, workers=None):
+    """Read tags for many files in a thread pool, returning {path: tags or None}"""
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers or TAG_READ_WORKERS) as executor:
+        results = dict(zip(paths, executor.map(read_tags, paths)))
+    tagged = sum(1 for tags in results.values() if tags)
+    print(f"Read tags from {tagged} of {len(paths)} tracks in {time.time() - start:.1f}s")
+    return results
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python audio_tags.py <audio_file> [<audio_file> ...]")
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        tags = read_tags(path)
+        print(path)
+        if tags is None:
+            print("  (no tags read)")
+            continue
+        for name in sorted(tags):
+            print(f"  {name}: {tags[name]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+SDXC Card Capacity Model
+------------------------
+Reads the real capacity, free space and cluster size of the mounted card with
+statvfs, and estimates how much space files and album directories really
+take on exFAT: each file is rounded up to whole clusters, and each directory
+uses at least one cluster for its 32-byte entries.
+"""
+
+import os
+
+# Configuration
+SAFETY_MARGIN_MIN = 1024 * 1024 * 1024  # Always keep at least 1GB free
+SAFETY_MARGIN_RATIO = 0.005  # ... or 0.5% of the card, whichever is larger
+
+# exFAT directory entries: one file entry, one stream extension entry and one
+# file name entry per 15 characters of the name, 32 bytes each
+DIR_ENTRY_SIZE = 32
+NAME_CHARS_PER_ENTRY = 15
+
+def get_card_capacity(mount_dir):
+    """Return the card's total and free bytes and its cluster size"""
+    st = os.statvfs(mount_dir)
+    # exFAT reports its cluster size as the fragment size
+    cluster_size = st.f_frsize or st.f_bsize
+    total_bytes = st.f_blocks * st.f_frsize
+    free_bytes = st.f_bavail * st.f_frsize
+    safety_margin = max(SAFETY_MARGIN_MIN, int(total_bytes * SAFETY_MARGIN_RATIO))
+    
+    return {
+        'cluster_size': cluster_size,
+        'total_bytes': total_bytes,
+        'free_bytes': free_bytes,
+        'safety_margin': safety_margin,
+        'usable_bytes': max(0, free_bytes - safety_margin)
+    }
+
+def round_to_clusters(size, cluster_size):
+    """Round a size (int or NumPy/pandas array) up to whole clusters"""
+    return -(-size // cluster_size) * cluster_size
+
+def dir_entries_size(name_length):
+    """Bytes of directory entries used by one file or directory name"""
+    return DIR_ENTRY_SIZE * (2 + -(-name_length // NAME_CHARS_PER_ENTRY))
+
+def print_capacity(capacity):
+    """Print a summary of the card's capacity"""
+    gb = 1024 * 1024 * 1024
+    print(f"Card capacity: {capacity['total_bytes'] / gb:.2f} GB, "
+          f"free: {capacity['free_bytes'] / gb:.2f} GB, "
+          f"cluster size: {capacity['cluster_size'] // 1024} KB")
+    print(f"Usable space after {capacity['safety_margin'] / gb:.2f} GB safety margin: "
+          f"{capacity['usable_bytes'] / gb:.2f} GB")
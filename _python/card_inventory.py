@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+SDXC Card Inventory
+-------------------
+Walks the SDXC card once with os.scandir and records every file's size and
+mtime, grouped by directory. The result is saved as a manifest on the host
+and shared by the fill, playlist and snapshot stages.
+
+On later runs only directories whose mtime changed are listed again; the
+file entries of unchanged directories are reused without any per-file stat.
+
+Usage: python card_inventory.py <mount_directory> [--subdirs <relative_dir>]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from user_paths import CACHE_DIR
+
+# Configuration
+INVENTORY_DIR = CACHE_DIR
+INVENTORY_VERSION = 1
+
+# Directories modified this close to the last scan are listed again, since a
+# change within the filesystem's timestamp granularity would not alter the mtime
+RACY_MTIME_NS = 2_000_000_000
+
+# Inventories already loaded by this process, keyed by real mount path
+_loaded_inventories = {}
+
+def get_manifest_path(mount_dir):
+    """Return the host-side manifest path for a mount directory"""
+    real_mount = os.path.realpath(mount_dir)
+    digest = hashlib.sha1(real_mount.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(INVENTORY_DIR, f"inventory_{digest}.json")
+
+def _read_manifest(manifest_path, mount_dir):
+    """Load a previous manifest, or return None if missing or unusable"""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if manifest.get('version') != INVENTORY_VERSION or manifest.get('mount_dir') != mount_dir:
+        return None
+    return manifest
+
+def _write_manifest(manifest_path, inventory):
+    """Save the inventory atomically so an interrupted run keeps the old manifest"""
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(inventory, f, separators=(',', ':'))
+    os.replace(tmp_path, manifest_path)
+
+def _list_directory(path):
+    """List one directory with scandir, returning (files, subdirs)"""
+    files = {}
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                st = entry.stat()
+                files[entry.name] = [st.st_size, st.st_mtime_ns]
+    subdirs.sort()
+    return files, subdirs
+
+def scan_card(mount_dir, use_manifest=True):
+    """Build the card inventory, reusing unchanged directories from the manifest"""
+    mount_dir = os.path.realpath(mount_dir)
+    manifest_path = get_manifest_path(mount_dir)
+    previous = _read_manifest(manifest_path, mount_dir) if use_manifest else None
+    old_dirs = previous['dirs'] if previous else {}
+    
+    print(f"Building card inventory for {mount_dir}...")
+    start = time.time()
+    scan_time_ns = time.time_ns()
+    
+    dirs = {}
+    listed = 0
+    reused = 0
+    
+    # Depth-first walk driven by the subdirectory lists, relative to the mount
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        path = os.path.join(mount_dir, rel_dir) if rel_dir else mount_dir
+        try:
+            dir_mtime_ns = os.stat(path).st_mtime_ns
+        except OSError as e:
+            print(f"Warning: Cannot access {path}: {e}")
+            continue
+        
+        old = old_dirs.get(rel_dir)
+        if old is not None and old['mtime_ns'] == dir_mtime_ns and old['scanned_ns'] - dir_mtime_ns > RACY_MTIME_NS:
+            entry = old
+            reused += 1
+        else:
+            try:
+                files, subdirs = _list_directory(path)
+            except OSError as e:
+                print(f"Warning: Cannot list {path}: {e}")
+                continue
+            entry = {'mtime_ns': dir_mtime_ns, 'scanned_ns': scan_time_ns, 'files': files, 'subdirs': subdirs}
+            listed += 1
+        
+        dirs[rel_dir] = entry
+        for name in reversed(entry['subdirs']):
+            stack.append(os.path.join(rel_dir, name) if rel_dir else name)
+    
+    inventory = {
+        'version': INVENTORY_VERSION,
+        'mount_dir': mount_dir,
+        'scanned': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'dirs': dirs,
+    }
+    
+    file_count = sum(len(entry['files']) for entry in dirs.values())
+    print(f"Card inventory: {file_count} files in {len(dirs)} directories "
+          f"({listed} listed, {reused} reused from manifest) in {time.time() - start:.1f}s")
+    
+    try:
+        _write_manifest(manifest_path, inventory)
+    except OSError as e:
+        print(f"Warning: Could not save card inventory manifest: {e}")
+    
+    return inventory
+
+def load_card_inventory(mount_dir, refresh=False):
+    """Return the card inventory, scanning at most once per process unless refresh is set"""
+    real_mount = os.path.realpath(mount_dir)
+    if refresh or real_mount not in _loaded_inventories:
+        _loaded_inventories[real_mount] = scan_card(real_mount)
+    return _loaded_inventories[real_mount]
+
+def _subtree(inventory, top):
+    """Yield (relative dir, entry) for a directory and everything below it, in sorted order"""
+    top = os.path.normpath(top) if top else ''
+    if top == '.':
+        top = ''
+    dirs = inventory['dirs']
+    stack = [top]
+    while stack:
+        rel_dir = stack.pop()
+        entry = dirs.get(rel_dir)
+        if entry is None:
+            continue
+        yield rel_dir, entry
+        for name in reversed(entry['subdirs']):
+            stack.append(os.path.join(rel_dir, name) if rel_dir else name)
+
+def iter_dirs(inventory, top='', mount_dir=None):
+    """Yield (dir path, {filename: [size, mtime_ns]}) for top and its subdirectories
+    
+    Paths are joined onto mount_dir, which defaults to the inventory's real mount path.
+    """
+    base_dir = mount_dir or inventory['mount_dir']
+    for rel_dir, entry in _subtree(inventory, top):
+        yield os.path.join(base_dir, rel_dir) if rel_dir else base_dir, entry['files']
+
+def iter_files(inventory, top='', mount_dir=None):
+    """Yield (file path, size, mtime_ns) for every file below top"""
+    for dir_path, files in iter_dirs(inventory, top, mount_dir):
+        for name in sorted(files):
+            size, mtime_ns = files[name]
+            yield os.path.join(dir_path, name), size, mtime_ns
+
+def get_dir_files(inventory, rel_dir):
+    """Return {filename: [size, mtime_ns]} for a directory relative to the mount (empty if unknown)"""
+    entry = inventory['dirs'].get(os.path.normpath(rel_dir))
+    return entry['files'] if entry else {}
+
+def list_subdirs(inventory, rel_dir):
+    """Return the names of the immediate subdirectories of a directory"""
+    entry = inventory['dirs'].get(os.path.normpath(rel_dir))
+    return list(entry['subdirs']) if entry else []
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python card_inventory.py <mount_directory> [--subdirs <relative_dir>]")
+        sys.exit(1)
+    
+    mount_dir = sys.argv[1]
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+    
+    if len(sys.argv) > 3 and sys.argv[2] == '--subdirs':
+        # Machine-readable listing for shell scripts; progress goes to stderr
+        rel_dir = sys.argv[3]
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            inventory = load_card_inventory(mount_dir)
+        finally:
+            sys.stdout = stdout
+        for name in list_subdirs(inventory, rel_dir):
+            print(os.path.join(inventory['mount_dir'], rel_dir, name))
+    else:
+        load_card_inventory(mount_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""
+SDXC Card Snapshot
+------------------
+Writes and reads snapshot files describing the albums on an SDXC card.
+
+Version 1 snapshots only list the albums:
+    <type>|<NAS path>
+
+Version 2 snapshots also record every file of each album, so a rebuild can
+tell a complete album from a partial one and detect albums that changed on
+the NAS without comparing every file with rsync:
+    <type>|<NAS path>|<file count>|<total bytes>
+    F|<path relative to the album>|<size>|<mtime_ns>|<crc32 or empty>
+
+The file entries come from the shared card inventory. CRC32 checksums are
+optional because they require reading every file on the card.
+
+Usage: python card_snapshot.py <mount_directory> <snapshot_file> <device> [checksum]
+"""
+
+import os
+import sys
+import time
+import zlib
+
+from card_inventory import iter_files, list_subdirs, load_card_inventory
+from clutter_policy import is_clutter_path
+
+# Configuration
+NAS_ROOT_CD = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
+NAS_ROOT_HIRES = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
+SNAPSHOT_VERSION = 2
+CHECKSUM_CHUNK_SIZE = 1024 * 1024  # 1MB reads when computing checksums
+
+# Album types, with their card directory and NAS root
+ALBUM_TYPES = [("CD", "Music/CD", NAS_ROOT_CD), ("HIRES", "Music/Hires", NAS_ROOT_HIRES)]
+CARD_DIRS = {album_type: card_dir for album_type, card_dir, _ in ALBUM_TYPES}
+
+def file_crc32(path):
+    """Return the CRC32 of a file as 8 hex digits"""
+    crc = 0
+    with open(path, 'rb', buffering=0) as f:
+        while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+def get_album_files(inventory, card_album_dir, mount_dir):
+    """Return {relative path: [size, mtime_ns]} for every file of a card album"""
+    album_path = os.path.join(mount_dir, card_album_dir)
+    prefix_len = len(album_path) + 1
+    return {path[prefix_len:]: [size, mtime_ns]
+            for path, size, mtime_ns in iter_files(inventory, card_album_dir, mount_dir)}
+
+def read_snapshot(snapshot_file):
+    """Parse a version 1 or 2 snapshot into a list of album dicts
+
+    Each album has 'type', 'nas_path' and 'card_dir' (relative to the mount).
+    For version 2 snapshots it also has 'file_count', 'total_bytes' and
+    'files' ({relative path: (size, mtime_ns, crc32 or None)}); these are
+    None for version 1 snapshots.
+    """
+    albums = []
+    version = 1
+    album = None
+    with open(snapshot_file, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip('\n')
+            if line.startswith('# Snapshot format version:'):
+                version = int(line.split(':', 1)[1])
+                continue
+
+            # Skip comments and empty lines
+            if not line or line.startswith('#'):
+                continue
+
+            if version >= 2 and line.startswith('F|'):
+                if album is None:
+                    print(f"Warning: File entry before any album on line {line_number}")
+                    continue
+                rel_path, size, mtime_ns, crc = line[2:].rsplit('|', 3)
+                album['files'][rel_path] = (int(size), int(mtime_ns), crc or None)
+                continue
+
+            album_type, _, rest = line.partition('|')
+            if album_type not in CARD_DIRS:
+                print(f"Warning: Unknown type '{album_type}' on line {line_number}: {rest}")
+                album = None
+                continue
+
+            if version >= 2:
+                path, file_count, total_bytes = rest.rsplit('|', 2)
+                album = {'file_count': int(file_count), 'total_bytes': int(total_bytes), 'files': {}}
+            else:
+                path = rest
+                album = {'file_count': None, 'total_bytes': None, 'files': None}
+            album['type'] = album_type
+            album['nas_path'] = path
+            album['card_dir'] = f"{CARD_DIRS[album_type]}/{os.path.basename(path)}"
+            albums.append(album)
+
+    return albums
+
+def write_snapshot(mount_dir, snapshot_file, device, checksum=False):
+    """Write a version 2 snapshot of the card, returning {type: album count}"""
+    inventory = load_card_inventory(mount_dir)
+    counts = {}
+    total_files = 0
+    total_bytes = 0
+    start = time.time()
+
+    tmp_file = snapshot_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as out:
+        out.write(f"# SDXC Card Snapshot created {time.strftime('%a %b %d %H:%M:%S %Y')}\n")
+        out.write(f"# Device: {device}\n")
+        out.write("# \n")
+        out.write(f"# Snapshot format version: {SNAPSHOT_VERSION}\n")
+        out.write("# Format: <type>|<NAS path>|<file count>|<total bytes>\n")
+        out.write("#         F|<relative path>|<size>|<mtime_ns>|<crc32 or empty>\n")
+        out.write("# \n")
+
+        for album_type, card_dir, nas_root in ALBUM_TYPES:
+            print(f"Recording {album_type} albums...")
+            counts[album_type] = 0
+            for album_name in list_subdirs(inventory, card_dir):
+                card_album_dir = f"{card_dir}/{album_name}"
+                files = get_album_files(inventory, card_album_dir, mount_dir)
+                files = {rel: entry for rel, entry in files.items() if not is_clutter_path(rel)}
+                album_bytes = sum(size for size, _ in files.values())
+
+                out.write(f"{album_type}|{nas_root}/{album_name}|{len(files)}|{album_bytes}\n")
+                for rel_path in sorted(files):
+                    size, mtime_ns = files[rel_path]
+                    crc = file_crc32(os.path.join(mount_dir, card_album_dir, rel_path)) if checksum else ""
+                    out.write(f"F|{rel_path}|{size}|{mtime_ns}|{crc}\n")
+
+                counts[album_type] += 1
+                total_files += len(files)
+                total_bytes += album_bytes
+
+        out.write("# \n")
+        out.write(f"# Summary: {counts['CD']} CD albums, {counts['HIRES']} HiRes albums\n")
+        out.write(f"# Total: {sum(counts.values())} albums, {total_files} files, {total_bytes} bytes\n")
+    os.replace(tmp_file, snapshot_file)
+
+    print(f"Recorded {total_files} files ({total_bytes / (1024*1024*1024):.2f} GB) "
+          f"{'with' if checksum else 'without'} checksums in {time.time() - start:.1f}s")
+    return counts
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: python card_snapshot.py <mount_directory> <snapshot_file> <device> [checksum]")
+        sys.exit(1)
+
+    mount_dir = sys.argv[1]
+    snapshot_file = sys.argv[2]
+    device = sys.argv[3]
+    checksum = len(sys.argv) > 4 and sys.argv[4] == "checksum"
+
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+
+    counts = write_snapshot(mount_dir, snapshot_file, device, checksum)
+    print(f"Snapshot created with {counts['CD']} CD albums and {counts['HIRES']} HiRes albums")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+Clutter Exclusion Policy
+------------------------
+The one definition of the files that never belong on the SDXC card:
+- Artwork folders ("Artwork" or "artwork")
+- Hidden files and folders (names starting with "."), including Mac Finder
+  metadata such as .DS_Store and ._* files
+- Files ending in .jpg, .png, .txt, .log or .url
+
+Every copy path (copy engine, in-process copier, rebuild, generated fill
+script) and every planner uses these rules, so clutter is skipped when
+copying instead of being written to the card and deleted afterwards by
+declutter.sh.
+"""
+
+import os
+
+# Configuration
+CLUTTER_DIR_NAMES = ("Artwork", "artwork")
+CLUTTER_EXTENSIONS = (".jpg", ".png", ".txt", ".log", ".url")
+
+# The same rules as rsync exclude patterns
+RSYNC_EXCLUDES = [".*"] + [f"*{ext}" for ext in CLUTTER_EXTENSIONS] + [f"{name}/" for name in CLUTTER_DIR_NAMES]
+
+def is_clutter_dir(name):
+    """Return True if a directory with this name is never copied"""
+    return name.startswith('.') or name in CLUTTER_DIR_NAMES
+
+def is_clutter_file(name):
+    """Return True if a file with this name is never copied"""
+    return name.startswith('.') or name.endswith(CLUTTER_EXTENSIONS)
+
+def is_clutter_path(path):
+    """Return True if a file path is clutter itself or lies inside a clutter directory"""
+    dirs, _, name = path.rpartition('/')
+    if is_clutter_file(name):
+        return True
+    return any(part and is_clutter_dir(part) for part in dirs.split('/'))
+
+def rsync_exclude_args():
+    """Return the policy as rsync command line arguments"""
+    return [f"--exclude={pattern}" for pattern in RSYNC_EXCLUDES]
+
+def walk_album_files(album_dir):
+    """Yield (path, path relative to album_dir) for every non-clutter file of an album"""
+    for root, dirs, files in os.walk(album_dir):
+        dirs[:] = [d for d in dirs if not is_clutter_dir(d)]
+        rel_root = os.path.relpath(root, album_dir)
+        for name in files:
+            if is_clutter_file(name):
+                continue
+            yield os.path.join(root, name), name if rel_root == '.' else f"{rel_root}/{name}"
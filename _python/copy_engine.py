@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Album Copy Engine
+-----------------
+Copies album directories from the NAS to the SDXC card with a bounded pool
+of workers. Each album goes through two stages:
+1. NAS stage: find the files that still need copying and read them once so
+   they are in the host's page cache
+2. SD stage: copy the album onto the card
+
+The stages have separate concurrency limits, so the next albums are read
+from the NAS while the card is busy writing the current one.
+
+Concurrency can be set with the SP3000_NAS_WORKERS and SP3000_SD_WORKERS
+environment variables. SP3000_COPY_METHOD=native copies the pending files
+in-process (see file_copier.py) instead of running rsync.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from card_inventory import get_dir_files
+from clutter_policy import is_clutter_dir, is_clutter_file, rsync_exclude_args
+from file_copier import copy_album_files, use_native_copy
+
+# Configuration
+NAS_READ_WORKERS = int(os.environ.get("SP3000_NAS_WORKERS", "2"))
+SD_WRITE_WORKERS = int(os.environ.get("SP3000_SD_WORKERS", "1"))
+PREFETCH_CHUNK_SIZE = 4 * 1024 * 1024  # 4MB reads when warming the page cache
+
+def find_pending_files(src_dir, dst_dir, inventory=None, mount_dir=None):
+    """List (source path, size) for files missing on the card or differing in size/mtime
+
+    With a card inventory, card files are looked up in it instead of being stat'ed.
+    Clutter (see clutter_policy.py) is never listed.
+    """
+    pending = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = [d for d in dirs if not is_clutter_dir(d)]
+        files = [f for f in files if not is_clutter_file(f)]
+        rel_root = os.path.relpath(root, src_dir)
+        dst_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        if inventory is not None:
+            card_files = get_dir_files(inventory, os.path.relpath(dst_root, mount_dir))
+        
+        for name in files:
+            src_path = os.path.join(root, name)
+            try:
+                src_st = os.stat(src_path)
+            except OSError:
+                continue
+            
+            # Same quick check rsync -t uses: size and whole-second mtime
+            if inventory is not None:
+                card_entry = card_files.get(name)
+                if card_entry and card_entry[0] == src_st.st_size and card_entry[1] // 1_000_000_000 == src_st.st_mtime_ns // 1_000_000_000:
+                    continue
+            else:
+                try:
+                    dst_st = os.stat(os.path.join(dst_root, name))
+                    if dst_st.st_size == src_st.st_size and int(dst_st.st_mtime) == int(src_st.st_mtime):
+                        continue
+                except OSError:
+                    pass
+            pending.append((src_path, src_st.st_size))
+    return pending
+
+def prefetch_files(pending):
+    """Read files once so the following copy is served from the page cache"""
+    for src_path, size in pending:
+        try:
+            with open(src_path, 'rb', buffering=0) as f:
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                while f.read(PREFETCH_CHUNK_SIZE):
+                    pass
+        except OSError as e:
+            print(f"  Warning: Could not read {src_path}: {e}")
+
+def rsync_album(src_dir, dst_dir):
+    """Copy one album directory with rsync, skipping clutter, returning True on success"""
+    cmd = ["rsync", "-rt", "--no-owner", "--no-group"] + rsync_exclude_args() + [f"{src_dir}/", f"{dst_dir}/"]
+    result = subprocess.run(cmd)
+    return result.returncode == 0
+
+class CopyEngine:
+    """Bounded worker pool that copies albums with separate NAS and SD limits"""
+    
+    def __init__(self, nas_workers=None, sd_workers=None, native=None):
+        self.native = use_native_copy() if native is None else native
+        self.nas_workers = max(1, nas_workers or NAS_READ_WORKERS)
+        self.sd_workers = max(1, sd_workers or SD_WRITE_WORKERS)
+        
+        # A job holds its worker while waiting for an SD slot, so at most
+        # nas_workers albums are prefetched ahead of the card
+        self.executor = ThreadPoolExecutor(max_workers=self.nas_workers + self.sd_workers)
+        self.nas_slots = threading.Semaphore(self.nas_workers)
+        self.sd_slots = threading.Semaphore(self.sd_workers)
+        
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.start_time = None
+        self.albums_copied = 0
+        self.albums_failed = 0
+        self.bytes_copied = 0
+    
+    def is_queued(self, src_dir):
+        """Return True if the album has already been submitted"""
+        with self.lock:
+            return src_dir in self.futures
+    
+    def submit(self, src_dir, dst_dir, label=None, pending=None):
+        """Queue an album copy; albums already queued are not copied twice
+
+        pending is the (path, size) list from find_pending_files, if already known.
+        """
+        with self.lock:
+            if src_dir in self.futures:
+                return self.futures[src_dir]
+            if self.start_time is None:
+                self.start_time = time.time()
+            future = self.executor.submit(self._copy_album, src_dir, dst_dir, label or src_dir, pending)
+            self.futures[src_dir] = future
+            return future
+    
+    def _copy_album(self, src_dir, dst_dir, label, pending):
+        """Run both stages for one album"""
+        try:
+            # NAS stage: work out what is missing and warm the page cache
+            with self.nas_slots:
+                if pending is None:
+                    pending = find_pending_files(src_dir, dst_dir)
+                if not pending:
+                    print(f"  Album already complete: {label}")
+                    return True
+                prefetch_files(pending)
+            
+            # SD stage: write the album to the card
+            with self.sd_slots:
+                print(f"  Copying album: {label}")
+                os.makedirs(dst_dir, exist_ok=True)
+                if self.native:
+                    ok = copy_album_files(src_dir, dst_dir, pending)
+                else:
+                    ok = rsync_album(src_dir, dst_dir)
+        except Exception as e:
+            print(f"  Error copying album {label}: {e}")
+            ok = False
+            pending = []
+        
+        with self.lock:
+            if ok:
+                self.albums_copied += 1
+                self.bytes_copied += sum(size for _, size in pending)
+            else:
+                self.albums_failed += 1
+        
+        if ok:
+            print(f"  Album copied successfully: {label}")
+        elif pending:
+            print(f"  Error copying album: {label}")
+        return ok
+    
+    def wait(self):
+        """Wait for all queued copies, print throughput and return (copied, failed, bytes)"""
+        with self.lock:
+            futures = list(self.futures.values())
+        wait(futures)
+        
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        if futures:
+            rate = self.bytes_copied / (1024 * 1024) / elapsed if elapsed > 0 else 0
+            print(f"\nCopied {self.albums_copied} albums ({self.bytes_copied / (1024*1024*1024):.2f} GB) "
+                  f"in {elapsed:.0f}s at {rate:.1f} MB/s "
+                  f"(NAS workers: {self.nas_workers}, SD workers: {self.sd_workers}, "
+                  f"copy method: {'native' if self.native else 'rsync'})")
+            if self.albums_failed:
+                print(f"Failed to copy {self.albums_failed} albums")
+        return self.albums_copied, self.albums_failed, self.bytes_copied
+    
+    def shutdown(self):
+        """Wait for queued copies and stop the worker threads"""
+        self.executor.shutdown(wait=True)
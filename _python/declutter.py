@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+SDXC Card Declutter
+-------------------
+This script:
+1. Walks the card once with os.scandir (or reuses the cached card inventory)
+   and matches every clutter rule in the same pass
+2. Deletes the matches in one batch, sorted by directory
+3. Reports the number of files and bytes reclaimed per rule
+
+The rules are the ones in clutter_policy.py:
+- Artwork directories (deleted with everything in them)
+- Mac Finder metadata files (.DS_Store and ._*)
+- Other hidden files (starting with ".")
+- Files with the clutter extensions (jpg, png, txt, log, url)
+
+Called by declutter.sh.
+Usage: python declutter.py <mount_directory> [--dry-run] [--inventory]
+"""
+
+import os
+import shutil
+import sys
+import time
+
+from card_inventory import iter_dirs, iter_files, load_card_inventory
+from clutter_policy import CLUTTER_DIR_NAMES, CLUTTER_EXTENSIONS
+
+# Rules in reporting order
+RULE_ARTWORK = "artwork directories"
+RULE_MAC_METADATA = "Mac Finder metadata files"
+RULE_HIDDEN = "hidden files"
+RULE_EXTENSIONS = "files with specified extensions"
+RULES = [RULE_ARTWORK, RULE_MAC_METADATA, RULE_HIDDEN, RULE_EXTENSIONS]
+
+def classify_file(name):
+    """Return the rule a file name matches, or None if it is kept"""
+    if name == ".DS_Store" or name.startswith("._"):
+        return RULE_MAC_METADATA
+    if name.startswith("."):
+        return RULE_HIDDEN
+    if name.endswith(CLUTTER_EXTENSIONS):
+        return RULE_EXTENSIONS
+    return None
+
+def _subtree_totals(path):
+    """Count the files and bytes below a directory that is about to be removed"""
+    files = 0
+    size = 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        files += 1
+                        size += entry.stat(follow_symlinks=False).st_size
+        except OSError as e:
+            print(f"Warning: Cannot list {current}: {e}")
+    return files, size
+
+def scan_card(mount_dir):
+    """Walk the card once, returning (directory matches, file matches)
+
+    Directory matches are (path, file count, bytes); file matches are (path, rule, bytes).
+    """
+    dir_matches = []
+    file_matches = []
+    stack = [mount_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in CLUTTER_DIR_NAMES:
+                            files, size = _subtree_totals(entry.path)
+                            dir_matches.append((entry.path, files, size))
+                        else:
+                            stack.append(entry.path)
+                        continue
+                    rule = classify_file(entry.name)
+                    if rule is not None:
+                        file_matches.append((entry.path, rule, entry.stat(follow_symlinks=False).st_size))
+        except OSError as e:
+            print(f"Warning: Cannot list {current}: {e}")
+    return dir_matches, file_matches
+
+def scan_inventory(mount_dir):
+    """Match the rules against the cached card inventory instead of walking the card"""
+    inventory = load_card_inventory(mount_dir)
+    dir_matches = []
+    file_matches = []
+    for dir_path, files in iter_dirs(inventory, '', mount_dir):
+        rel_parts = os.path.relpath(dir_path, mount_dir).split(os.sep)
+        # Everything below an artwork directory is counted with it
+        if any(part in CLUTTER_DIR_NAMES for part in rel_parts[:-1]):
+            continue
+        if rel_parts[-1] in CLUTTER_DIR_NAMES:
+            rel_dir = os.path.relpath(dir_path, mount_dir)
+            sizes = [size for _, size, _ in iter_files(inventory, rel_dir, mount_dir)]
+            dir_matches.append((dir_path, len(sizes), sum(sizes)))
+            continue
+        for name, (size, _) in files.items():
+            rule = classify_file(name)
+            if rule is not None:
+                file_matches.append((os.path.join(dir_path, name), rule, size))
+    return dir_matches, file_matches
+
+def delete_matches(dir_matches, file_matches, dry_run=False):
+    """Delete every match in one batch, returning {rule: [files, bytes]} actually reclaimed"""
+    totals = {rule: [0, 0] for rule in RULES}
+    verb = "Would delete" if dry_run else "Deleting"
+
+    # Directories first, so files inside them are not deleted twice
+    for path, files, size in sorted(dir_matches):
+        print(f"{verb} {path}/ ({files} files)")
+        if not dry_run:
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                print(f"Warning: Could not delete {path}: {e}")
+                continue
+        totals[RULE_ARTWORK][0] += files
+        totals[RULE_ARTWORK][1] += size
+
+    # Sorted by path so deletions in the same directory are grouped together
+    for path, rule, size in sorted(file_matches):
+        print(f"{verb} {path}")
+        if not dry_run:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"Warning: Could not delete {path}: {e}")
+                continue
+        totals[rule][0] += 1
+        totals[rule][1] += size
+
+    return totals
+
+def declutter(mount_dir, dry_run=False, use_inventory=False):
+    """Find and delete clutter on the card, returning the total number of files"""
+    start = time.time()
+    if use_inventory:
+        dir_matches, file_matches = scan_inventory(mount_dir)
+    else:
+        print(f"Scanning {mount_dir}...")
+        dir_matches, file_matches = scan_card(mount_dir)
+    print(f"Found {len(dir_matches)} artwork directories and {len(file_matches)} clutter files "
+          f"in {time.time() - start:.1f}s")
+
+    totals = delete_matches(dir_matches, file_matches, dry_run)
+
+    print("\nDry run, nothing was deleted:" if dry_run else "\nCleanup summary:")
+    for rule in RULES:
+        files, size = totals[rule]
+        print(f"  {rule}: {files} files, {size / (1024*1024):.1f} MB")
+    total_files = sum(files for files, _ in totals.values())
+    total_bytes = sum(size for _, size in totals.values())
+    action = "to delete" if dry_run else "deleted"
+    print(f"Total files {action}: {total_files} ({total_bytes / (1024*1024):.1f} MB)")
+    return total_files
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python declutter.py <mount_directory> [--dry-run] [--inventory]")
+        sys.exit(1)
+
+    mount_dir = sys.argv[1]
+    dry_run = "--dry-run" in sys.argv[2:]
+    use_inventory = "--inventory" in sys.argv[2:]
+
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+
+    declutter(mount_dir, dry_run, use_inventory)
+
+if __name__ == "__main__":
+    main()
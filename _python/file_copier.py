@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+In-Process File Copier
+----------------------
+Copies album files from the NAS to the SDXC card without forking rsync.
+rsync's delta algorithm buys nothing when both sides are local mounts, so
+files are copied whole using the kernel's zero-copy paths:
+1. os.copy_file_range
+2. os.sendfile, if copy_file_range is unavailable or refused
+3. Large buffered reads and writes as a last resort
+
+Destination files are preallocated with posix_fallocate where supported
+(less fragmentation on exFAT), written under a temporary name and renamed
+into place once complete, and keep the source mtime so later size/mtime
+checks skip them.
+
+The copy method used by the copy engine, rebuild and the generated fill
+script is chosen with the SP3000_COPY_METHOD environment variable:
+"rsync" (default) or "native".
+
+Usage: python file_copier.py <source_album_dir> <destination_album_dir>
+       python file_copier.py --batch <album_list>
+
+With --batch, every album in the list (one "source<TAB>destination<TAB>label"
+line per album, as written by tracks-filler.py) is copied in this one process
+through the copy engine.
+"""
+
+import errno
+import os
+import sys
+
+# Configuration
+COPY_METHOD = os.environ.get("SP3000_COPY_METHOD", "rsync").lower()
+COPY_CHUNK_SIZE = 64 * 1024 * 1024  # Bytes per copy_file_range/sendfile call
+BUFFER_SIZE = 8 * 1024 * 1024  # Buffer for the read/write fallback
+TEMP_PREFIX = ".sp3000_partial_"  # Hidden, so declutter and excludes skip leftovers
+
+# Errors meaning "this copy mechanism is not supported here, try the next one"
+UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+def use_native_copy():
+    """Return True if the in-process copier is selected instead of rsync"""
+    return COPY_METHOD == "native"
+
+def _preallocate(fd, size):
+    """Reserve the destination's space up front where the filesystem supports it"""
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRNOS:
+            raise
+
+def _copy_range(src_fd, dst_fd, size, offset):
+    """Copy with copy_file_range, returning the new offset (stops early if unsupported)"""
+    if not hasattr(os, 'copy_file_range'):
+        return offset
+    while offset < size:
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - offset),
+                                        offset_src=offset, offset_dst=offset)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                return offset
+            raise
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+def _copy_sendfile(src_fd, dst_fd, size, offset):
+    """Copy with sendfile, returning the new offset (stops early if unsupported)"""
+    if not hasattr(os, 'sendfile'):
+        return offset
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+        try:
+            copied = os.sendfile(dst_fd, src_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                return offset
+            raise
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+def _copy_buffered(src_fd, dst_fd, offset):
+    """Copy the rest of the file with plain reads and writes"""
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = os.readv(src_fd, [buffer])
+        if count == 0:
+            return offset
+        written = 0
+        while written < count:
+            written += os.write(dst_fd, view[written:count])
+        offset += count
+
+def copy_file(src_path, dst_path):
+    """Copy one file, keeping its mtime, and return the number of bytes copied"""
+    src_st = os.stat(src_path)
+    size = src_st.st_size
+    dst_dir, name = os.path.split(dst_path)
+    tmp_path = os.path.join(dst_dir, TEMP_PREFIX + name)
+
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _preallocate(dst_fd, size)
+            offset = _copy_range(src_fd, dst_fd, size, 0)
+            if offset < size:
+                offset = _copy_sendfile(src_fd, dst_fd, size, offset)
+            if offset < size:
+                offset = _copy_buffered(src_fd, dst_fd, offset)
+            # The source may have shrunk while copying; drop preallocated space
+            os.ftruncate(dst_fd, offset)
+        finally:
+            os.close(dst_fd)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        os.close(src_fd)
+
+    os.utime(tmp_path, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+    os.replace(tmp_path, dst_path)
+    return offset
+
+def copy_album_files(src_dir, dst_dir, pending):
+    """Copy the (source path, size) files of one album into dst_dir
+
+    Returns True if every file was copied.
+    """
+    ok = True
+    made_dirs = set()
+    for src_path, _ in pending:
+        dst_path = os.path.join(dst_dir, os.path.relpath(src_path, src_dir))
+        parent = os.path.dirname(dst_path)
+        try:
+            if parent not in made_dirs:
+                os.makedirs(parent, exist_ok=True)
+                made_dirs.add(parent)
+            copy_file(src_path, dst_path)
+        except OSError as e:
+            print(f"  Error copying {src_path}: {e}")
+            ok = False
+    return ok
+
+def copy_album_list(list_path):
+    """Copy every album of an album list with the copy engine, returning the number that failed"""
+    # Imported here so the module itself has no dependency on the copy engine
+    from copy_engine import CopyEngine
+
+    with open(list_path, encoding='utf-8') as album_list:
+        albums = [line.rstrip('\n').split('\t') for line in album_list if line.strip()]
+    print(f"Copying {len(albums)} albums")
+
+    copy_engine = CopyEngine(native=True)
+    missing = 0
+    try:
+        for index, (src_dir, dst_dir, label) in enumerate(albums, 1):
+            if not os.path.isdir(src_dir):
+                print(f"  Error: Source directory {src_dir} does not exist")
+                missing += 1
+                continue
+            copy_engine.submit(src_dir, dst_dir, f"{index} of {len(albums)}: {label}")
+        _, failed, _ = copy_engine.wait()
+    finally:
+        copy_engine.shutdown()
+    return missing + failed
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python file_copier.py <source_album_dir> <destination_album_dir>")
+        print("       python file_copier.py --batch <album_list>")
+        sys.exit(1)
+
+    if sys.argv[1] == '--batch':
+        if copy_album_list(sys.argv[2]):
+            sys.exit(1)
+        return
+
+    # Imported here so the module itself has no dependency on the copy engine
+    from copy_engine import find_pending_files
+
+    src_dir = sys.argv[1].rstrip('/')
+    dst_dir = sys.argv[2].rstrip('/')
+    if not os.path.isdir(src_dir):
+        print(f"Error: Source directory {src_dir} does not exist")
+        sys.exit(1)
+
+    pending = find_pending_files(src_dir, dst_dir)
+    if not pending:
+        print("  Album already complete")
+        return
+    if not copy_album_files(src_dir, dst_dir, pending):
+        sys.exit(1)
+    print(f"  Copied {len(pending)} files ({sum(size for _, size in pending) / (1024*1024):.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Library Cache for LibraryTracks.xlsx
+------------------------------------
+Parsing the full library workbook with pandas/openpyxl takes minutes on a
+large library. This module converts the workbook once into an Arrow IPC
+(Feather v2) file stored on the host, keyed by the workbook's size and mtime.
+Later runs memory-map the cache and load only the columns they need.
+
+If pyarrow is not installed, the workbook is read directly with pandas.
+"""
+
+import hashlib
+import os
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+from user_paths import CACHE_DIR
+
+def _cache_prefix(track_file):
+    """Prefix shared by every cache file generated from this workbook"""
+    real_path = os.path.realpath(track_file)
+    digest = hashlib.sha1(real_path.encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(track_file))[0]
+    return f"{stem}_{digest}_"
+
+def get_cache_path(track_file):
+    """Return the cache file path for the current version of the workbook"""
+    st = os.stat(track_file)
+    return os.path.join(CACHE_DIR, f"{_cache_prefix(track_file)}{st.st_size}_{st.st_mtime_ns}.arrow")
+
+def _remove_stale_caches(track_file, keep_path):
+    """Delete caches built from older versions of the workbook"""
+    prefix = _cache_prefix(track_file)
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.startswith(prefix) and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not remove stale cache {path}: {e}")
+
+def _make_arrow_safe(df):
+    """Convert mixed-type object columns to strings so Arrow can store them"""
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+        if inferred not in ('string', 'empty'):
+            not_null = df[col].notna()
+            df[col] = df[col].where(~not_null, df[col].astype(str))
+    # Arrow requires string column names
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+def _build_cache(track_file, cache_path):
+    """Parse the workbook and write it as an uncompressed Arrow file"""
+    print(f"Building library cache from: {track_file}")
+    start = time.time()
+    df = _make_arrow_safe(pd.read_excel(track_file))
+    
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    # Uncompressed so the file can be memory-mapped without decoding
+    feather.write_feather(df, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    _remove_stale_caches(track_file, cache_path)
+    
+    print(f"Cached {len(df)} tracks in {time.time() - start:.1f}s: {cache_path}")
+    return df
+
+def ensure_library_cache(track_file):
+    """Return the path of an up-to-date cache, rebuilding it if needed"""
+    cache_path = get_cache_path(track_file)
+    if not os.path.exists(cache_path):
+        _build_cache(track_file, cache_path)
+    return cache_path
+
+def get_library_columns(track_file):
+    """Return the column names of the library without loading any data"""
+    if feather is None:
+        return pd.read_excel(track_file, nrows=0).columns.tolist()
+    
+    cache_path = ensure_library_cache(track_file)
+    with pa.memory_map(cache_path, 'r') as source:
+        return pa.ipc.open_file(source).schema.names
+
+def load_library_tracks(track_file, columns=None):
+    """Load library tracks, optionally restricted to the given columns"""
+    if feather is None:
+        print("pyarrow not installed, reading Excel file directly (this may be slow)")
+        if columns is None:
+            return pd.read_excel(track_file)
+        wanted = {str(col) for col in columns}
+        return pd.read_excel(track_file, usecols=lambda col: str(col) in wanted)
+    
+    start = time.time()
+    cache_path = ensure_library_cache(track_file)
+    
+    if columns is not None:
+        available = set(get_library_columns(track_file))
+        columns = [str(col) for col in columns if str(col) in available]
+    
+    table = feather.read_table(cache_path, columns=columns, memory_map=True)
+    df = table.to_pandas()
+    print(f"Loaded {len(df)} tracks ({len(df.columns)} columns) from cache in {time.time() - start:.2f}s")
+    return df
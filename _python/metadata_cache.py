@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Track Metadata Cache
+--------------------
+Keeps the parsed tags of every track in an SQLite database on the host, keyed
+by path, size and mtime. On later runs only new or changed files are opened
+and parsed; everything else is answered from the database.
+
+Derived per-track features (for example audio analysis results) can be stored
+next to the tags. They are dropped automatically when the file changes.
+
+Used by playlist-generator.py and tracks-filler.py, which print the hit/miss
+statistics and the estimated time saved at the end of the run.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+from audio_tags import read_all_tags
+from user_paths import CACHE_DIR
+
+# Configuration
+CACHE_FILE = "track_metadata.sqlite"
+SCHEMA_VERSION = 1
+
+class MetadataCache:
+    """SQLite-backed cache of parsed track tags and derived features"""
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            db_path = os.path.join(CACHE_DIR, CACHE_FILE)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.conn.executescript(f"""
+                DROP TABLE IF EXISTS tracks;
+                CREATE TABLE tracks (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    tags TEXT,
+                    tags_parsed INTEGER NOT NULL DEFAULT 0,
+                    features TEXT,
+                    parse_seconds REAL NOT NULL DEFAULT 0
+                );
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+
+        self.hits = 0
+        self.misses = 0
+        self.parse_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def get_tags(self, entries):
+        """Return {path: tags or None} for (path, size, mtime_ns) entries
+
+        Files whose path, size and mtime match the cache are not opened; the
+        rest are parsed in a thread pool and stored.
+        """
+        entries = list(entries)
+        wanted = {path: (size, mtime_ns) for path, size, mtime_ns in entries}
+        results = {}
+
+        # One pass over the table is faster than one query per track
+        for path, size, mtime_ns, tags, parse_seconds in self.conn.execute(
+                "SELECT path, size, mtime_ns, tags, parse_seconds FROM tracks WHERE tags_parsed"):
+            if wanted.get(path) == (size, mtime_ns):
+                results[path] = json.loads(tags) if tags else None
+                self.saved_seconds += parse_seconds
+        self.hits += len(results)
+
+        stale = [path for path in wanted if path not in results]
+        if stale:
+            start = time.time()
+            parsed = read_all_tags(stale)
+            elapsed = time.time() - start
+            per_track = elapsed / len(stale)
+            self.misses += len(stale)
+            self.parse_seconds += elapsed
+
+            # Unreadable files are stored too, so they are not retried until they change.
+            # Features survive only if the file is unchanged.
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO tracks (path, size, mtime_ns, tags, tags_parsed, parse_seconds) "
+                    "VALUES (?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET "
+                    "features = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns "
+                    "THEN features ELSE NULL END, "
+                    "size = excluded.size, mtime_ns = excluded.mtime_ns, tags = excluded.tags, "
+                    "tags_parsed = 1, parse_seconds = excluded.parse_seconds",
+                    [(path, *wanted[path], json.dumps(parsed[path]) if parsed[path] else None, per_track)
+                     for path in stale])
+            results.update(parsed)
+
+        return results
+
+    def get_features(self, path, size, mtime_ns):
+        """Return the stored features of an unchanged file, or None"""
+        row = self.conn.execute(
+            "SELECT features FROM tracks WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def get_all_features(self, entries):
+        """Return {path: features} for the (path, size, mtime_ns) entries that have unchanged stored features"""
+        wanted = {path: (size, mtime_ns) for path, size, mtime_ns in entries}
+        results = {}
+        for path, size, mtime_ns, features in self.conn.execute(
+                "SELECT path, size, mtime_ns, features FROM tracks WHERE features IS NOT NULL"):
+            if wanted.get(path) == (size, mtime_ns):
+                results[path] = json.loads(features)
+        return results
+
+    def set_features(self, path, size, mtime_ns, features):
+        """Store derived features for a file (its tags are kept if already cached)"""
+        with self.conn:
+            updated = self.conn.execute(
+                "UPDATE tracks SET features = ? WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (json.dumps(features), path, size, mtime_ns)).rowcount
+            if not updated:
+                # A changed or unknown file: its tags are parsed again on the next lookup
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO tracks (path, size, mtime_ns, features) VALUES (?, ?, ?, ?)",
+                    (path, size, mtime_ns, json.dumps(features)))
+
+    def print_stats(self):
+        """Print hit/miss counts and the parsing time the cache saved"""
+        total = self.hits + self.misses
+        if total == 0:
+            return
+        print(f"\nMetadata cache: {self.hits} hits, {self.misses} misses "
+              f"({self.hits / total * 100:.1f}% hit rate)")
+        print(f"  Parsed {self.misses} files in {self.parse_seconds:.1f}s, "
+              f"saved about {self.saved_seconds:.1f}s by not re-reading {self.hits} files")
+
+    def close(self):
+        self.conn.close()
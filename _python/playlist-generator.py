@@ -9,20 +9,41 @@ from the music already on your SDXC card.
 Updated to use the new directory structure and relative paths.
 """
 
+import bisect
 import os
 import sys
+import numpy as np
 import pandas as pd
 import random
 import re
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
 
+from card_inventory import iter_dirs, load_card_inventory
+from library_cache import get_library_columns, load_library_tracks
+from metadata_cache import MetadataCache
+from playlist_files import PlaylistWriter
+from track_store import TrackStore
+from transition_engine import build_features, candidate_pool, order_tracks
+
 # Configuration
 NAS_ROOT_CD = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
 NAS_ROOT_HIRES = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
 TRACK_COUNT = 50  # Tracks per playlist
 
+# Flow playlists to build: genre names and decades such as "1990s", separated by commas
+PLAYLISTS = os.environ.get("SP3000_PLAYLISTS", "Electronic,Jazz,Hip-Hop,House,Soul-Funk")
+# How many of the generated playlists (Discovery included) one track may appear in
+MAX_PLAYLISTS_PER_TRACK = int(os.environ.get("SP3000_MAX_PLAYLISTS_PER_TRACK", "1"))
+
+# Discovery playlist diversity caps: tracks per artist and album, and the
+# largest share of the playlist a single genre or decade may take
+DISCOVERY_MAX_PER_ARTIST = 3
+DISCOVERY_MAX_PER_ALBUM = 2
+DISCOVERY_GENRE_SHARE = 0.25
+DISCOVERY_DECADE_SHARE = 0.5
+
 # Genre mapping to consolidate similar genres
 GENRE_MAPPING = {
     # Electronic genres
@@ -130,15 +151,47 @@ GENRE_MAPPING = {
     "acoustic": "Acoustic"
 }
 
+# All genre keywords compiled into one pattern. Keywords only match as whole
+# words (so "rap" does not match "trapeze"), longer keywords are tried first at
+# each position, and when several keywords match the longest one wins, with
+# ties going to the keyword listed first in GENRE_MAPPING.
+GENRE_KEYWORD_RANK = {keyword: (-len(keyword), index) for index, keyword in enumerate(GENRE_MAPPING)}
+GENRE_PATTERN = re.compile(
+    r'(?<![a-z0-9])('
+    + '|'.join(re.escape(keyword) for keyword in sorted(GENRE_MAPPING, key=GENRE_KEYWORD_RANK.get))
+    + r')(?![a-z0-9])')
+MAJOR_GENRES = list(dict.fromkeys(GENRE_MAPPING.values()))
+
 # Globals
 sdxc_tracks = []
-genre_tracks = defaultdict(list)
-track_info = {}
+sdxc_track_stats = {}
+metadata_cache = None
+track_store = TrackStore()
+playlist_writer = PlaylistWriter()
+genre_groups = {}
+track_features = None
 play_count_data = {}
+play_count_by_card_key = {}
+play_count_first_by_basename = {}
+play_count_reversed_basenames = []
+play_count_fuzzy_cache = {}
+genre_match_cache = {}
+
+def classify_genre(text):
+    """Map a genre tag or path onto the consolidated genres, or return "Unknown"
+    
+    Results are cached, so each distinct text is only matched once.
+    """
+    genre = genre_match_cache.get(text)
+    if genre is None:
+        keywords = GENRE_PATTERN.findall(text.lower())
+        genre = GENRE_MAPPING[min(keywords, key=GENRE_KEYWORD_RANK.get)] if keywords else "Unknown"
+        genre_match_cache[text] = genre
+    return genre
 
 def scan_sdxc_for_tracks(mount_dir):
     """Scan the SDXC card for music files and build a track database"""
-    global sdxc_tracks, genre_tracks
+    global sdxc_tracks, sdxc_track_stats
     
     # New directory structure
     sdxc_cd = os.path.join(mount_dir, "Music", "CD")
@@ -149,21 +202,18 @@ def scan_sdxc_for_tracks(mount_dir):
     
     music_extensions = ('.flac', '.mp3', '.wav', '.aiff', '.alac', '.ape', '.dsf', '.dff')
     
-    # Scan CD directory
-    if os.path.exists(sdxc_cd):
-        for root, dirs, files in os.walk(sdxc_cd):
-            for file in files:
-                if file.lower().endswith(music_extensions):
-                    track_path = os.path.join(root, file)
-                    sdxc_tracks.append(track_path)
+    # Use the shared card inventory instead of walking the card again
+    inventory = load_card_inventory(mount_dir)
     
-    # Scan HiRes directory
-    if os.path.exists(sdxc_hires):
-        for root, dirs, files in os.walk(sdxc_hires):
-            for file in files:
+    # Collect CD and HiRes tracks
+    for sdxc_dir in (sdxc_cd, sdxc_hires):
+        top = os.path.relpath(sdxc_dir, mount_dir)
+        for root, files in iter_dirs(inventory, top, mount_dir):
+            for file in sorted(files):
                 if file.lower().endswith(music_extensions):
                     track_path = os.path.join(root, file)
                     sdxc_tracks.append(track_path)
+                    sdxc_track_stats[track_path] = files[file]
     
     print(f"Found {len(sdxc_tracks)} music tracks on SDXC card")
     
@@ -172,19 +222,24 @@ def scan_sdxc_for_tracks(mount_dir):
     
     return sdxc_cd, sdxc_hires, playlist_dir
 
+def extract_year(date):
+    """Return the year of a tag date such as '1998' or '1998-03-02', or 0"""
+    match = re.match(r'\s*(\d{4})', date or '')
+    return int(match.group(1)) if match else 0
+
 def extract_track_info_from_paths(sdxc_cd, sdxc_hires):
-    """Extract track information from file paths and names"""
-    global sdxc_tracks, track_info, genre_tracks
+    """Extract track information from FLAC/DSF tags, falling back to file paths and names"""
+    global sdxc_tracks, track_store, genre_groups, metadata_cache
     
-    print("Extracting track information from file paths...")
+    # Tags come from the metadata cache; only new or changed files are parsed
+    print("Reading track tags...")
+    if metadata_cache is None:
+        metadata_cache = MetadataCache()
+    track_tags = metadata_cache.get_tags((path, *sdxc_track_stats[path]) for path in sdxc_tracks)
+    genres_from_tags = 0
     
-    def guess_genre_from_path(path):
-        """Attempt to guess genre from the path"""
-        path_lower = path.lower()
-        for genre_keyword, mapped_genre in GENRE_MAPPING.items():
-            if genre_keyword in path_lower:
-                return mapped_genre
-        return "Unknown"
+    print("Extracting track information from tags and file paths...")
+    track_store = TrackStore()
     
     def extract_track_number(filename):
         """Extract track number from filename"""
@@ -212,26 +267,26 @@ def extract_track_info_from_paths(sdxc_cd, sdxc_hires):
         parent_dir = os.path.basename(directory)
         
         # Determine if track is in CD or HiRes
-        is_hires = False
-        is_cd = False
-        
         # Get path relative to SDXC root - check for new structure
         if track_path.startswith(sdxc_hires):
             is_hires = True
             relative_path = os.path.relpath(track_path, sdxc_hires)
         elif track_path.startswith(sdxc_cd):
-            is_cd = True
+            is_hires = False
             relative_path = os.path.relpath(track_path, sdxc_cd)
         else:
             # Skip tracks outside of expected directories
             continue
         
+        # Real tags where the file has them, path guesses otherwise
+        tags = track_tags.get(track_path) or {}
+        
         # Split path components for artist/album guessing
         path_parts = relative_path.split(os.path.sep)
         
         # Try to extract artist and album from path
-        artist = path_parts[0] if len(path_parts) > 0 else "Unknown Artist"
-        album = path_parts[1] if len(path_parts) > 1 else parent_dir
+        artist = tags.get('artist') or (path_parts[0] if len(path_parts) > 0 else "Unknown Artist")
+        album = tags.get('album') or (path_parts[1] if len(path_parts) > 1 else parent_dir)
         
         # Clean up filename to get track title
         title = filename
@@ -242,34 +297,66 @@ def extract_track_info_from_paths(sdxc_cd, sdxc_hires):
         title_clean = re.sub(r'^\d+[\s.\-_]+', '', title)
         
         # Extract track number
-        track_number = extract_track_number(filename)
+        track_number = tags.get('track_number') or extract_track_number(filename)
         
-        # Guess genre from path
-        genre = guess_genre_from_path(track_path)
+        # Map the tagged genre onto the consolidated genres (keeping unmapped
+        # tag genres as they are), or guess it from the album's directories.
+        # Path guesses are cached per directory, so each album is matched once.
+        tag_genre = tags.get('genre')
+        if tag_genre:
+            genre = classify_genre(tag_genre)
+            if genre == "Unknown":
+                genre = tag_genre
+            genres_from_tags += 1
+        else:
+            genre = classify_genre(os.path.dirname(relative_path))
         
         # Store track info
-        track_info[track_path] = {
-            'path': track_path,
-            'artist': artist,
-            'album': album,
-            'title': title_clean or title,
-            'track_number': track_number,
-            'genre': genre,
-            'is_hires': is_hires,
-            'is_cd': is_cd
-        }
-        
-        # Add to genre tracks
-        genre_tracks[genre].append(track_path)
-    
-    # Also add tracks to broader genre groups
-    major_genres = set(GENRE_MAPPING.values())
-    for genre in list(major_genres):
-        if genre not in genre_tracks:
-            genre_tracks[genre] = []
-            for track, info in track_info.items():
-                if info['genre'] in genre or genre in info['genre']:
-                    genre_tracks[genre].append(track)
+        track_store.add(
+            track_path,
+            title=tags.get('title') or title_clean or title,
+            artist=artist,
+            album=album,
+            genre=genre,
+            track_number=track_number,
+            duration=tags.get('duration', 0),
+            sample_rate=tags.get('sample_rate', 0),
+            bit_depth=tags.get('bit_depth', 0),
+            year=extract_year(tags.get('date')),
+            is_hires=is_hires
+        )
+    
+    track_store.finalize()
+    print(f"Genres from tags: {genres_from_tags}, guessed from paths: {len(track_store) - genres_from_tags}")
+    
+    # Every genre with tracks is its own group. A major genre without tracks of
+    # its own groups every genre name it contains or is part of.
+    track_genres = track_store.names['genre']
+    genre_groups = {genre: [genre] for genre in track_genres}
+    for genre in MAJOR_GENRES:
+        if genre not in genre_groups:
+            genre_groups[genre] = [g for g in track_genres if g in genre or genre in g]
+
+def load_track_analysis():
+    """Copy the measured energy, loudness and tempo from the feature cache into the track store"""
+    paths = track_store.paths
+    stored = metadata_cache.get_all_features((path, *sdxc_track_stats[path]) for path in paths)
+    columns = {'energy': 'energy', 'loudness': 'rms_db', 'tempo': 'tempo'}
+    values = {column: np.full(len(paths), np.nan) for column in columns}
+    measured = 0
+    for row, path in enumerate(paths):
+        features = stored.get(path)
+        if not features or 'energy' not in features:
+            continue
+        for column, key in columns.items():
+            values[column][row] = features[key]
+        measured += 1
+    for column in columns:
+        track_store.set_column(column, values[column])
+    
+    print(f"Measured energy available for {measured} of {len(paths)} tracks")
+    if measured < len(paths):
+        print("  Run ./create-playlists.sh with 'analyze' to measure the remaining tracks")
 
 def load_play_count_data(tracks_excel):
     """Load play count data from the tracks Excel file if available"""
@@ -282,14 +369,13 @@ def load_play_count_data(tracks_excel):
     print(f"Loading play count data from: {tracks_excel}")
     
     try:
-        tracks_df = pd.read_excel(tracks_excel)
-        print(f"Loaded {len(tracks_df)} tracks from Excel")
+        columns = get_library_columns(tracks_excel)
         
         # Check for path and play count columns
         path_column = None
         play_count_column = None
         
-        for col in tracks_df.columns:
+        for col in columns:
             col_lower = str(col).lower()
             if 'path' in col_lower or 'file' in col_lower or 'location' in col_lower:
                 path_column = col
@@ -304,12 +390,15 @@ def load_play_count_data(tracks_excel):
             print("Could not find play count column in Excel. All tracks will have equal play count.")
             return
         
+        # Only the path and play count columns are needed
+        tracks_df = load_library_tracks(tracks_excel, [path_column, play_count_column])
+        print(f"Loaded {len(tracks_df)} tracks from Excel")
+        
         # Build play count mapping
-        for _, row in tracks_df.iterrows():
-            path = str(row.get(path_column, ''))
-            play_count = row.get(play_count_column, 0)
+        for path, play_count in zip(tracks_df[path_column], tracks_df[play_count_column]):
+            path = str(path)
             
-            if pd.isna(path) or pd.isna(play_count):
+            if pd.isna(play_count):
                 continue
             
             # Store by full path
@@ -321,96 +410,244 @@ def load_play_count_data(tracks_excel):
                 play_count_data[filename] = play_count
         
         print(f"Loaded play count data for {len(play_count_data)} tracks")
+        
+        # Build lookup indexes once so each track lookup is near-constant time
+        build_play_count_index()
     
     except Exception as e:
         print(f"Error loading play count data: {e}")
         import traceback
         traceback.print_exc()
 
-def get_track_play_count(track_path):
+def nas_path_to_card_key(path):
+    """Map a NAS track path to its location under Music/ on the card (e.g. CD/Artist/Album/file)"""
+    if path.startswith(NAS_ROOT_HIRES + '/'):
+        return "Hires/" + path[len(NAS_ROOT_HIRES):].lstrip('/')
+    if path.startswith(NAS_ROOT_CD + '/'):
+        return "CD/" + path[len(NAS_ROOT_CD):].lstrip('/')
+    return None
+
+def card_path_to_card_key(track_path, sdxc_cd, sdxc_hires):
+    """Return the part of an SDXC track path below the Music directory (e.g. CD/Artist/Album/file)"""
+    if track_path.startswith(sdxc_hires + '/'):
+        return "Hires/" + track_path[len(sdxc_hires) + 1:]
+    if track_path.startswith(sdxc_cd + '/'):
+        return "CD/" + track_path[len(sdxc_cd) + 1:]
+    return None
+
+def build_play_count_index():
+    """Build the card-path and filename-suffix indexes over play_count_data"""
+    global play_count_by_card_key, play_count_first_by_basename, play_count_reversed_basenames
+    
+    play_count_by_card_key = {}
+    play_count_first_by_basename = {}
+    paths_by_basename = defaultdict(set)
+    
+    for order, (path, count) in enumerate(play_count_data.items()):
+        # Card location of NAS paths (Artist/Album/file below CD or Hires)
+        card_key = nas_path_to_card_key(path)
+        if card_key is not None:
+            play_count_by_card_key[card_key] = count
+            paths_by_basename[os.path.basename(path)].add(path)
+        
+        # First key (in insertion order) for every basename, used by the suffix fallback
+        basename = os.path.basename(path)
+        if basename not in play_count_first_by_basename:
+            play_count_first_by_basename[basename] = (order, path)
+    
+    # Reversed basenames sorted so "basename ends with X" becomes a prefix range search
+    play_count_reversed_basenames = sorted(basename[::-1] for basename in play_count_first_by_basename)
+    play_count_fuzzy_cache.clear()
+    
+    # Report filenames shared by several library tracks, where filename matching is a guess
+    ambiguous = {name: paths for name, paths in paths_by_basename.items() if len(paths) > 1}
+    if ambiguous:
+        print(f"Warning: {len(ambiguous)} filenames are shared by multiple library tracks; "
+              "these only match by filename if the card path cannot be mapped to the NAS")
+        for name, paths in list(ambiguous.items())[:5]:
+            print(f"  - {name} ({len(paths)} tracks)")
+
+def find_fuzzy_play_count_key(filename):
+    """Find the first play count key whose basename is a suffix of filename or ends with it"""
+    if filename in play_count_fuzzy_cache:
+        return play_count_fuzzy_cache[filename]
+    
+    best = None
+    
+    # Basenames that are a suffix of the filename: a hash lookup per suffix
+    for i in range(len(filename) + 1):
+        entry = play_count_first_by_basename.get(filename[i:])
+        if entry is not None and (best is None or entry[0] < best[0]):
+            best = entry
+    
+    # Basenames that end with the filename: a prefix range in the reversed list
+    reversed_name = filename[::-1]
+    j = bisect.bisect_left(play_count_reversed_basenames, reversed_name)
+    while j < len(play_count_reversed_basenames) and play_count_reversed_basenames[j].startswith(reversed_name):
+        entry = play_count_first_by_basename[play_count_reversed_basenames[j][::-1]]
+        if best is None or entry[0] < best[0]:
+            best = entry
+        j += 1
+    
+    key = best[1] if best is not None else None
+    play_count_fuzzy_cache[filename] = key
+    return key
+
+def get_track_play_count(track_path, sdxc_cd, sdxc_hires):
     """Get play count for a track, with fallback matching"""
     # Try direct path match
     if track_path in play_count_data:
         return play_count_data[track_path]
     
+    # Try mapping the card path to its NAS path
+    card_key = card_path_to_card_key(track_path, sdxc_cd, sdxc_hires)
+    if card_key in play_count_by_card_key:
+        return play_count_by_card_key[card_key]
+    
     # Try matching by filename
     filename = os.path.basename(track_path)
     if filename in play_count_data:
         return play_count_data[filename]
     
-    # Last resort: try fuzzy matching with any path ending
-    for path, count in play_count_data.items():
-        if path.endswith(filename) or filename.endswith(os.path.basename(path)):
-            return count
+    # Last resort: fuzzy matching on filename suffixes, via the prebuilt indexes
+    key = find_fuzzy_play_count_key(filename)
+    if key is not None:
+        return play_count_data[key]
     
     return 0  # Default to 0 if no match found
 
-def create_flow_optimized_playlist(genre, count, playlist_dir, sdxc_cd, sdxc_hires):
-    """Create a DJ-like flow-optimized playlist for a genre"""
-    print(f"Creating flow-optimized playlist for {genre} ({count} tracks)...")
-    
-    # Get tracks for this genre
-    genre_specific_tracks = genre_tracks.get(genre, [])
+class DiversitySelector:
+    """Select tracks in order while capping how many share a value of some fields
+    
+    caps maps a field name (such as 'artist', 'album', 'genre' or 'decade')
+    to the most selected tracks that may share a value of it, and columns maps
+    the same names to one integer code per track in the track store. Counts are
+    kept incrementally, so each candidate is checked in constant time. Tracks
+    whose code is -1 are not limited by that field's cap.
+    """
+    
+    def __init__(self, caps, columns):
+        self.caps = dict(caps)
+        self.columns = {field: columns[field].tolist() for field in self.caps}
+        self.counts = {field: Counter() for field in self.caps}
+        self.selected = []
+        self.selected_rows = set()
+    
+    def allows(self, row, fields=None):
+        """Return True if adding the track keeps every cap in fields (default all)"""
+        for field in self.caps if fields is None else fields:
+            value = self.columns[field][row]
+            if value >= 0 and self.counts[field][value] >= self.caps[field]:
+                return False
+        return True
+    
+    def add(self, row):
+        """Add a track and count it against every cap"""
+        self.selected.append(row)
+        self.selected_rows.add(row)
+        for field, counts in self.counts.items():
+            value = self.columns[field][row]
+            if value >= 0:
+                counts[value] += 1
+    
+    def select(self, rows, count, fields=None):
+        """Add tracks in order until count are selected, skipping repeats and capped tracks
+        
+        Only the caps in fields (default all) are enforced; every cap keeps counting.
+        Returns the number of tracks added.
+        """
+        added = 0
+        for row in rows:
+            if len(self.selected) >= count:
+                break
+            if row in self.selected_rows or not self.allows(row, fields):
+                continue
+            self.add(row)
+            added += 1
+        return added
+
+def write_playlist(playlist_path, rows, sdxc_cd, sdxc_hires):
+    """Write tracks of the track store to an M3U playlist with paths relative to the playlist directory
+    
+    Returns False if the playlist on the card already had this content and was left unchanged.
+    """
+    entries = []
+    # Tracks with relative paths
+    for row in rows:
+        track_path = track_store.paths[row]
+        
+        # Convert absolute path to relative path from playlist directory
+        if track_store['is_hires'][row]:
+            # For HiRes tracks: ../Hires/Artist/Album/track.flac
+            rel_path = os.path.relpath(track_path, sdxc_hires)
+            rel_track_path = os.path.join("../Hires", rel_path)
+        else:
+            # For CD tracks: ../CD/Artist/Album/track.flac
+            rel_path = os.path.relpath(track_path, sdxc_cd)
+            rel_track_path = os.path.join("../CD", rel_path)
+        
+        # Add track to playlist with metadata
+        entries.append((track_store.value('artist', row), track_store.titles[row], rel_track_path))
+    return playlist_writer.write(playlist_path, entries)
+
+def parse_decade(name):
+    """Return the decade of a playlist request such as "1990s", or None for a genre name"""
+    match = re.fullmatch(r'(\d{3}0)s', name.strip())
+    return int(match.group(1)) if match else None
+
+def find_genre_tracks(genre):
+    """Return a mask of the tracks in a genre, widened to similar genres if it has very few"""
+    genre_mask = track_store.mask(genre=genre_groups.get(genre, [genre]))
     
-    if len(genre_specific_tracks) < 10:
+    if genre_mask.sum() < 10:
         print(f"Not enough tracks for genre {genre}, looking for similar genres")
         # Look for similar genres
-        for g, tracks in genre_tracks.items():
+        for g, names in genre_groups.items():
             if genre.lower() in g.lower() or g.lower() in genre.lower():
-                genre_specific_tracks.extend(tracks)
-    
-    if len(genre_specific_tracks) < count:
-        print(f"Still only found {len(genre_specific_tracks)} tracks for genre {genre}")
-        if len(genre_specific_tracks) < 5:
-            print(f"Too few tracks to create a playlist for {genre}")
-            return False
-    
-    # Remove duplicates
-    genre_specific_tracks = list(set(genre_specific_tracks))
-    
-    # Get info for all tracks
-    track_entries = []
-    for track_path in genre_specific_tracks:
-        if track_path in track_info:
-            info = track_info[track_path]
-            
-            # Calculate energy level (approximated by track number position in album)
-            album_tracks = [t for t in genre_specific_tracks if track_info[t]['album'] == info['album']]
-            track_count = len(album_tracks)
-            track_number = info['track_number']
-            
-            # Approximate energy level
-            if track_count > 0 and track_number > 0:
-                # Position 0-1 within album (0 = first track, 1 = last track)
-                position = (track_number - 1) / max(1, track_count - 1) if track_count > 1 else 0.5
-                
-                # Energy often follows a curve: starts medium, rises, then falls
-                # Highest energy is often around 60-70% through the album
-                # This creates a curve peaking at 0.65
-                energy = 1 - abs(position - 0.65) * 1.5
-                energy = max(0.1, min(1.0, energy))  # Keep between 0.1 and 1.0
-            else:
-                energy = 0.5  # Middle energy if we can't determine position
-            
-            # Get play count
-            play_count = get_track_play_count(track_path)
-            
-            track_entries.append({
-                'path': track_path,
-                'artist': info['artist'],
-                'title': info['title'],
-                'album': info['album'],
-                'track_number': track_number,
-                'energy': energy,
-                'play_count': play_count,
-                'is_hires': info['is_hires'],
-                'is_cd': info['is_cd']
-            })
-    
-    # Limit to top tracks by play count if we have too many
-    if len(track_entries) > count * 3:
-        track_entries.sort(key=lambda x: x['play_count'], reverse=True)
-        track_entries = track_entries[:count * 3]
+                genre_mask |= track_store.mask(genre=names)
+    return genre_mask
+
+def select_flow_tracks(name, rows, count):
+    """Pick and order up to count of the given store rows as a DJ-like flow
+    
+    Returns the rows of the playlist in play order, or None if there are too few tracks.
+    """
+    track_total = len(rows)
+    if track_total < count:
+        print(f"Still only found {track_total} tracks for {name}")
+        if track_total < 5:
+            print(f"Too few tracks to create a playlist for {name}")
+            return None
+    
+    # Tracks per album within this genre
+    album_codes = track_store['album']
+    album_track_counts = np.bincount(album_codes[rows], minlength=len(track_store.names['album']))
+    
+    # Limit to top tracks by play count if we have too many; with feature
+    # vectors, a third of the pool is the nearest neighbours of the top tracks
+    if len(rows) > count * 3:
+        rows = rows[np.argsort(-track_store['play_count'][rows], kind='stable')]
+        if track_features is not None:
+            rows = candidate_pool(rows, track_features, count * 2, count * 3)
+        else:
+            rows = rows[:count * 3]
+    
+    # Calculate energy level: measured by audio_analysis.py where available,
+    # otherwise approximated by track number position in album
+    track_counts = album_track_counts[album_codes[rows]]
+    track_numbers = track_store['track_number'][rows]
+    
+    # Position 0-1 within album (0 = first track, 1 = last track)
+    position = np.where(track_counts > 1, (track_numbers - 1) / np.maximum(1, track_counts - 1), 0.5)
+    
+    # Energy often follows a curve: starts medium, rises, then falls
+    # Highest energy is often around 60-70% through the album
+    # This creates a curve peaking at 0.65, kept between 0.1 and 1.0
+    energy = np.clip(1 - np.abs(position - 0.65) * 1.5, 0.1, 1.0)
+    # Middle energy if we can't determine position
+    energy = np.where((track_counts > 0) & (track_numbers > 0), energy, 0.5)
+    measured = track_store['energy'][rows]
+    energy = np.where(np.isnan(measured), energy, measured)
     
     # Create DJ-like flow
     # 1. Start with medium energy
@@ -419,10 +656,12 @@ def create_flow_optimized_playlist(genre, count, playlist_dir, sdxc_cd, sdxc_hir
     # 4. Gradually bring energy down
     
     # Sort tracks by energy to allow us to select from different energy levels
-    track_entries.sort(key=lambda x: x['energy'])
+    order = np.argsort(energy, kind='stable')
+    rows = rows[order]
+    energy = energy[order]
     
     # Select tracks for different parts of the mix
-    total_tracks = min(count, len(track_entries))
+    total_tracks = min(count, len(rows))
     
     # Calculate how many tracks for each section
     intro_count = max(1, int(total_tracks * 0.15))  # 15% - Medium energy intro
@@ -436,209 +675,148 @@ def create_flow_optimized_playlist(genre, count, playlist_dir, sdxc_cd, sdxc_hir
     peak_range = (0.8, 1.0)  # Highest energy
     outro_range = (0.2, 0.5)  # Medium to low
     
-    # Filter tracks for each section
-    def filter_energy_range(tracks, min_e, max_e):
-        return [t for t in tracks if min_e <= t['energy'] <= max_e]
-    
-    intro_tracks = filter_energy_range(track_entries, *intro_range)
-    buildup_tracks = filter_energy_range(track_entries, *buildup_range)
-    peak_tracks = filter_energy_range(track_entries, *peak_range)
-    outro_tracks = filter_energy_range(track_entries, *outro_range)
-    
-    # If we don't have enough tracks in a specific energy range, take from the closest section
-    if len(intro_tracks) < intro_count:
-        # Get more tracks from the general pool and sort by distance to intro energy
-        additional = [t for t in track_entries if t not in intro_tracks]
-        additional.sort(key=lambda x: abs(x['energy'] - 0.4))  # Sort by closeness to middle of intro range
-        intro_tracks.extend(additional[:intro_count - len(intro_tracks)])
-    
-    if len(buildup_tracks) < buildup_count:
-        additional = [t for t in track_entries if t not in buildup_tracks and t not in intro_tracks]
-        additional.sort(key=lambda x: abs(x['energy'] - 0.65))  # Middle of buildup range
-        buildup_tracks.extend(additional[:buildup_count - len(buildup_tracks)])
-    
-    if len(peak_tracks) < peak_count:
-        additional = [t for t in track_entries if t not in peak_tracks and t not in intro_tracks and t not in buildup_tracks]
-        additional.sort(key=lambda x: abs(x['energy'] - 0.9))  # Middle of peak range
-        peak_tracks.extend(additional[:peak_count - len(peak_tracks)])
-    
-    if len(outro_tracks) < outro_count:
-        additional = [t for t in track_entries if t not in outro_tracks and t not in intro_tracks 
-                     and t not in buildup_tracks and t not in peak_tracks]
-        additional.sort(key=lambda x: abs(x['energy'] - 0.35))  # Middle of outro range
-        outro_tracks.extend(additional[:outro_count - len(outro_tracks)])
+    # Tracks are sorted by energy, so each range is a contiguous slice
+    # (sections hold positions in the energy-sorted rows)
+    def filter_energy_range(min_e, max_e):
+        lo = np.searchsorted(energy, min_e, side='left')
+        hi = np.searchsorted(energy, max_e, side='right')
+        return np.arange(lo, hi)
+    
+    # If we don't have enough tracks in a specific energy range, take from the closest section,
+    # skipping tracks already taken by an earlier section
+    taken = np.zeros(len(rows), dtype=bool)
+    
+    def fill_section(section, section_count, target_energy):
+        if len(section) < section_count:
+            taken[section] = True
+            additional = np.flatnonzero(~taken)
+            additional = additional[np.argsort(np.abs(energy[additional] - target_energy), kind='stable')]
+            section = np.concatenate([section, additional[:section_count - len(section)]])
+        taken[section] = True
+        return section
+    
+    intro_tracks = fill_section(filter_energy_range(*intro_range), intro_count, 0.4)  # Middle of intro range
+    buildup_tracks = fill_section(filter_energy_range(*buildup_range), buildup_count, 0.65)  # Middle of buildup range
+    peak_tracks = fill_section(filter_energy_range(*peak_range), peak_count, 0.9)  # Middle of peak range
+    outro_tracks = fill_section(filter_energy_range(*outro_range), outro_count, 0.35)  # Middle of outro range
     
     # Sort each section by energy (ascending for intro & buildup, descending for outro)
-    intro_tracks.sort(key=lambda x: x['energy'])
-    buildup_tracks.sort(key=lambda x: x['energy'])
-    peak_tracks.sort(key=lambda x: random.random())  # Shuffle peak tracks for variety
-    outro_tracks.sort(key=lambda x: -x['energy'])  # Descending energy
-    
-    # Select the number of tracks we need from each section
-    selected_intro = intro_tracks[:intro_count]
-    selected_buildup = buildup_tracks[:buildup_count]
-    selected_peak = peak_tracks[:peak_count]
-    selected_outro = outro_tracks[:outro_count]
-    
-    # Combine all sections for the final playlist
-    final_tracks = selected_intro + selected_buildup + selected_peak + selected_outro
-    
-    # Ensure no duplicate tracks (can happen if sections overlap)
-    seen_paths = set()
-    unique_tracks = []
-    for track in final_tracks:
-        if track['path'] not in seen_paths:
-            seen_paths.add(track['path'])
-            unique_tracks.append(track)
-    
-    final_tracks = unique_tracks[:count]  # Limit to requested count
-    
-    # Create M3U playlist
-    # Replace any slashes in genre name with dashes to avoid directory issues
-    safe_genre = genre.replace('/', '-')
-    playlist_name = f"{safe_genre}_Top{len(final_tracks)}"
-    playlist_path = os.path.join(playlist_dir, f"{playlist_name}.m3u")
-    
-    with open(playlist_path, 'w', encoding='utf-8') as m3u:
-        # Write M3U header
-        m3u.write("#EXTM3U\n")
-        
-        # Write tracks with relative paths
-        for track in final_tracks:
-            track_path = track['path']
-            
-            # Convert absolute path to relative path from playlist directory
-            if track['is_hires']:
-                # For HiRes tracks: ../Hires/Artist/Album/track.flac
-                rel_path = os.path.relpath(track_path, sdxc_hires)
-                rel_track_path = os.path.join("../Hires", rel_path)
-            else:
-                # For CD tracks: ../CD/Artist/Album/track.flac
-                rel_path = os.path.relpath(track_path, sdxc_cd)
-                rel_track_path = os.path.join("../CD", rel_path)
-            
-            # Add track to playlist with metadata
-            m3u.write(f"#EXTINF:-1,{track['artist']} - {track['title']}\n")
-            m3u.write(f"{rel_track_path}\n")
-    
-    print(f"Created {genre} playlist with {len(final_tracks)} tracks: {playlist_path}")
-    return True
+    intro_tracks = intro_tracks[np.argsort(energy[intro_tracks], kind='stable')]
+    buildup_tracks = buildup_tracks[np.argsort(energy[buildup_tracks], kind='stable')]
+    peak_tracks = sorted(peak_tracks.tolist(), key=lambda x: random.random())  # Shuffle peak tracks for variety
+    outro_tracks = outro_tracks[np.argsort(-energy[outro_tracks], kind='stable')]  # Descending energy
+    
+    # Select the number of tracks we need from each section and combine them
+    final_tracks = (intro_tracks[:intro_count].tolist() + buildup_tracks[:buildup_count].tolist()
+                    + peak_tracks[:peak_count] + outro_tracks[:outro_count].tolist())
+    
+    # Ensure no duplicate tracks (can happen if sections overlap), limited to requested count
+    chosen = list(dict.fromkeys(final_tracks))[:count]
+    
+    # Order the chosen tracks so each transition is to a similar track while
+    # the energy follows the intro/buildup/peak/outro curve
+    if track_features is not None:
+        order = order_tracks(track_features[rows[chosen]], energy[chosen])
+        chosen = [chosen[i] for i in order]
+    return rows[chosen]
 
-def create_discovery_playlist(count, playlist_dir, sdxc_cd, sdxc_hires):
-    """Create a discovery playlist of tracks with low or no play counts"""
-    print(f"Creating discovery playlist with {count} tracks...")
-    
+def select_discovery_tracks(count, available):
+    """Pick a diverse selection of available tracks with low or no play counts"""
     # Sort all tracks by play count (lowest first)
-    discovery_candidates = []
-    for track_path in sdxc_tracks:
-        if track_path in track_info:
-            info = track_info[track_path]
-            play_count = get_track_play_count(track_path)
-            
-            discovery_candidates.append({
-                'path': track_path,
-                'artist': info['artist'],
-                'title': info['title'],
-                'album': info['album'],
-                'genre': info['genre'],
-                'play_count': play_count,
-                'is_hires': info['is_hires'],
-                'is_cd': info['is_cd']
-            })
-    
-    # Sort by play count (lowest first)
-    discovery_candidates.sort(key=lambda x: x['play_count'])
-    
-    # Create a diverse selection (different artists, albums, genres)
-    selected_tracks = []
-    artists_used = set()
-    albums_used = set()
-    genres_used = set()
+    play_counts = track_store['play_count']
+    discovery_candidates = np.argsort(play_counts, kind='stable')
+    discovery_candidates = discovery_candidates[available[discovery_candidates]]
+    
+    # Create a diverse selection (different artists, albums, genres, decades)
+    selector = DiversitySelector({
+        'artist': DISCOVERY_MAX_PER_ARTIST,
+        'album': DISCOVERY_MAX_PER_ALBUM,
+        'genre': count * DISCOVERY_GENRE_SHARE,
+        'decade': count * DISCOVERY_DECADE_SHARE,
+    }, {
+        'artist': track_store['artist'],
+        'album': track_store['album'],
+        'genre': track_store['genre'],
+        'decade': track_store.decades(),
+    })
     
     # First, get tracks with zero plays
-    zero_play_tracks = [t for t in discovery_candidates if t['play_count'] == 0]
+    zero_play_tracks = track_store.indices((play_counts == 0) & available).tolist()
     
     # Shuffle zero play tracks for randomness
     random.shuffle(zero_play_tracks)
     
     # Take tracks ensuring diversity
-    for track in zero_play_tracks:
-        # Skip if we already have enough tracks
-        if len(selected_tracks) >= count:
-            break
-        
-        # Skip if we already have too many from this artist
-        if track['artist'] in artists_used and len([t for t in selected_tracks if t['artist'] == track['artist']]) >= 3:
-            continue
-        
-        # Skip if we already have too many from this album
-        if track['album'] in albums_used and len([t for t in selected_tracks if t['album'] == track['album']]) >= 2:
-            continue
-        
-        # Skip if we already have too many from this genre
-        if track['genre'] in genres_used and len([t for t in selected_tracks if t['genre'] == track['genre']]) >= count / 4:
-            continue
-        
-        # Add track
-        selected_tracks.append(track)
-        artists_used.add(track['artist'])
-        albums_used.add(track['album'])
-        genres_used.add(track['genre'])
-    
-    # If we still don't have enough tracks, add more from low play counts
-    if len(selected_tracks) < count:
-        low_play_tracks = [t for t in discovery_candidates if t not in selected_tracks]
-        
-        for track in low_play_tracks:
-            if len(selected_tracks) >= count:
-                break
-            
-            # Skip if we already have too many from this artist
-            if track['artist'] in artists_used and len([t for t in selected_tracks if t['artist'] == track['artist']]) >= 3:
-                continue
-            
-            # Skip if we already have too many from this album
-            if track['album'] in albums_used and len([t for t in selected_tracks if t['album'] == track['album']]) >= 2:
-                continue
-            
-            # Add track
-            selected_tracks.append(track)
-            artists_used.add(track['artist'])
-            albums_used.add(track['album'])
+    selector.select(zero_play_tracks, count)
+    
+    # If we still don't have enough tracks, add more from low play counts,
+    # keeping only the artist and album caps
+    selector.select(discovery_candidates.tolist(), count, fields=('artist', 'album'))
+    selected_tracks = selector.selected
     
     # Shuffle for final order
     random.shuffle(selected_tracks)
-    selected_tracks = selected_tracks[:count]
-    
-    # Create M3U playlist
-    playlist_path = os.path.join(playlist_dir, "Discovery_50.m3u")
+    return selected_tracks[:count]
+
+def generate_playlists(names, count, playlist_dir, sdxc_cd, sdxc_hires, max_uses=MAX_PLAYLISTS_PER_TRACK):
+    """Build the requested flow playlists and the discovery playlist together
+    
+    Every track may appear in at most max_uses of the playlists. Playlists with
+    the fewest candidate tracks choose first, so a broad genre cannot use up a
+    small genre's tracks; the discovery playlist chooses last from what is left.
+    Returns the number of flow playlists created.
+    """
+    start = time.time()
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    decades = track_store.decades()
+    use_counts = np.zeros(len(track_store), dtype=np.int32)
+    
+    # Candidate tracks of every playlist, from the shared track store
+    candidates = {}
+    for name in names:
+        decade = parse_decade(name)
+        candidates[name] = decades == decade if decade is not None else find_genre_tracks(name)
+    
+    # Allocate tracks, scarcest playlists first
+    selected = {}
+    for name in sorted(names, key=lambda name: int(candidates[name].sum())):
+        print(f"Creating flow-optimized playlist for {name} ({count} tracks)...")
+        rows = track_store.indices(candidates[name] & (use_counts < max_uses))
+        final_rows = select_flow_tracks(name, rows, count)
+        if final_rows is not None:
+            use_counts[final_rows] += 1
+            selected[name] = final_rows
     
-    with open(playlist_path, 'w', encoding='utf-8') as m3u:
-        # Write M3U header
-        m3u.write("#EXTM3U\n")
-        
-        # Write tracks with relative paths
-        for track in selected_tracks:
-            track_path = track['path']
-            
-            # Convert absolute path to relative path from playlist directory
-            if track['is_hires']:
-                # For HiRes tracks: ../Hires/Artist/Album/track.flac
-                rel_path = os.path.relpath(track_path, sdxc_hires)
-                rel_track_path = os.path.join("../Hires", rel_path)
-            else:
-                # For CD tracks: ../CD/Artist/Album/track.flac
-                rel_path = os.path.relpath(track_path, sdxc_cd)
-                rel_track_path = os.path.join("../CD", rel_path)
-            
-            # Add track to playlist with metadata
-            m3u.write(f"#EXTINF:-1,{track['artist']} - {track['title']}\n")
-            m3u.write(f"{rel_track_path}\n")
+    print(f"Creating discovery playlist with {count} tracks...")
+    discovery_rows = select_discovery_tracks(count, use_counts < max_uses)
+    use_counts[discovery_rows] += 1
+    
+    # Write the playlists in the requested order
+    for name, final_rows in ((name, selected[name]) for name in names if name in selected):
+        # Replace any slashes in the name with dashes to avoid directory issues
+        safe_name = name.replace('/', '-')
+        playlist_path = os.path.join(playlist_dir, f"{safe_name}_Top{len(final_rows)}.m3u")
+        if write_playlist(playlist_path, final_rows, sdxc_cd, sdxc_hires):
+            print(f"Created {name} playlist with {len(final_rows)} tracks: {playlist_path}")
+        else:
+            print(f"{name} playlist unchanged ({len(final_rows)} tracks): {playlist_path}")
     
-    print(f"Created discovery playlist with {len(selected_tracks)} tracks: {playlist_path}")
-    return True
+    playlist_path = os.path.join(playlist_dir, "Discovery_50.m3u")
+    if write_playlist(playlist_path, discovery_rows, sdxc_cd, sdxc_hires):
+        print(f"Created discovery playlist with {len(discovery_rows)} tracks: {playlist_path}")
+    else:
+        print(f"Discovery playlist unchanged ({len(discovery_rows)} tracks): {playlist_path}")
+    
+    total = int(use_counts.sum())
+    distinct = int((use_counts > 0).sum())
+    print(f"Built {len(selected) + 1} playlists with {total} tracks ({distinct} distinct, "
+          f"at most {max_uses} playlist{'s' if max_uses != 1 else ''} per track) "
+          f"in {time.time() - start:.1f}s")
+    return len(selected)
 
 def main():
+    global track_features
+    
     # Parse command line arguments
     if len(sys.argv) < 2:
         print("Usage: python playlist-generator.py <tracks_excel> [<mount_directory>]")
@@ -664,30 +842,35 @@ def main():
     
     # Extract track info from paths
     extract_track_info_from_paths(sdxc_cd, sdxc_hires)
+    load_track_analysis()
     
     # Load play count data if available
     load_play_count_data(tracks_excel)
+    play_counts = pd.to_numeric(pd.Series([get_track_play_count(path, sdxc_cd, sdxc_hires)
+                                           for path in track_store.paths], dtype=object),
+                                errors='coerce')
+    track_store.set_column('play_count', play_counts.fillna(0).to_numpy())
     
-    # Create genre playlists
-    genres_to_create = ["Electronic", "Jazz", "Hip-Hop", "House", "Soul-Funk"]
-    created_count = 0
+    # Feature vectors for choosing and ordering playlist tracks
+    track_features = build_features(track_store)
     
-    for genre in genres_to_create:
-        if create_flow_optimized_playlist(genre, TRACK_COUNT, playlist_dir, sdxc_cd, sdxc_hires):
-            created_count += 1
-    
-    # Create discovery playlist
-    create_discovery_playlist(TRACK_COUNT, playlist_dir, sdxc_cd, sdxc_hires)
+    # Create the genre and decade playlists and the discovery playlist together
+    created_count = generate_playlists(PLAYLISTS.split(','), TRACK_COUNT, playlist_dir, sdxc_cd, sdxc_hires)
     
     # Summary
-    print(f"\nCreated {created_count} genre playlists and 1 discovery playlist")
+    print(f"\nCreated {created_count} genre/decade playlists and 1 discovery playlist")
     print(f"All playlists are saved in: {playlist_dir}")
+    playlist_writer.print_stats()
     
     # List all playlists
     print("\nGenerated playlists:")
     for playlist_file in os.listdir(playlist_dir):
         if playlist_file.endswith('.m3u'):
             print(f"  - {playlist_file}")
+    
+    if metadata_cache is not None:
+        metadata_cache.print_stats()
+        metadata_cache.close()
 
 if __name__ == "__main__":
     main()
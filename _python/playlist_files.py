@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+M3U Playlist Files
+------------------
+Writes M3U playlists only when their content changed. Each playlist is
+rendered in memory and its hash compared with the file already on the card;
+an unchanged playlist is not written, so the card sees no write and the
+player does not rescan its library because of a new mtime.
+
+Changed playlists are written to a temporary file next to the target and
+renamed over it, so a playlist is never left half-written.
+
+Used by process-playlists.py and playlist-generator.py.
+"""
+
+import contextlib
+import hashlib
+import os
+
+def render_m3u(entries):
+    """Return the M3U text for (artist, title, path) entries"""
+    lines = ["#EXTM3U\n"]
+    for artist, title, path in entries:
+        lines.append(f"#EXTINF:-1,{artist} - {title}\n")
+        lines.append(f"{path}\n")
+    return ''.join(lines)
+
+def _file_digest(path, expected_size):
+    """Return the SHA-256 of a file, or None if it is missing or not expected_size bytes"""
+    try:
+        if os.path.getsize(path) != expected_size:
+            return None
+        with open(path, 'rb') as existing:
+            return hashlib.sha256(existing.read()).digest()
+    except OSError:
+        return None
+
+class PlaylistWriter:
+    """Writes playlists atomically, skipping those whose content is unchanged"""
+
+    def __init__(self):
+        self.written = 0
+        self.unchanged = 0
+
+    def write(self, path, entries):
+        """Write a playlist of (artist, title, path) entries; return True if the file was written"""
+        data = render_m3u(entries).encode('utf-8')
+        if _file_digest(path, len(data)) == hashlib.sha256(data).digest():
+            self.unchanged += 1
+            return False
+
+        directory, name = os.path.split(path)
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+        try:
+            with open(tmp_path, 'wb') as m3u:
+                m3u.write(data)
+                m3u.flush()
+                os.fsync(m3u.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        self.written += 1
+        return True
+
+    def print_stats(self):
+        """Print how many playlists were written and how many were left unchanged"""
+        print(f"Playlists written: {self.written}, unchanged: {self.unchanged}")
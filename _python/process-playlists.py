@@ -5,9 +5,12 @@ Playlist Processor for A&K SP3000
 ---------------------------------
 This script:
 1. Looks in the _playlists directory for Excel files
-2. Processes each track in each playlist
-3. Copies the entire album containing each track from NAS to SDXC
-4. Builds M3U files that describe each playlist with absolute paths
+2. Reads the tracks of every playlist
+3. Plans one deduplicated set of album copies for all playlists
+4. Copies the entire album containing each track from NAS to SDXC
+   (in parallel, through the shared copy engine)
+5. Builds M3U files that describe each playlist with absolute paths,
+   rewriting only the playlists whose content changed
 """
 
 import os
@@ -15,12 +18,20 @@ import sys
 import pandas as pd
 import time
 from pathlib import Path
-import subprocess
 import re
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from card_inventory import load_card_inventory
+from copy_engine import CopyEngine, find_pending_files
+from playlist_files import PlaylistWriter
 
 # Configuration
 NAS_ROOT_CD = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
 NAS_ROOT_HIRES = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
+PLAN_WORKERS = 8  # Parallel NAS directory scans while planning copies
+PARSE_WORKERS = os.cpu_count() or 1  # Processes used to parse playlist workbooks
 
 def ensure_directories_exist(mount_dir):
     """Ensure required directories exist"""
@@ -44,25 +55,23 @@ def sanitize_filename(name):
     sanitized = sanitized.strip('. ')
     return sanitized
 
-def process_playlist_file(playlist_file, mount_dir):
-    """Process a single playlist Excel file and create an M3U playlist"""
-    sdxc_cd, sdxc_hires, playlist_dir = ensure_directories_exist(mount_dir)
-    
-    print(f"\nProcessing playlist: {os.path.basename(playlist_file)}")
-    
-    # Generate output playlist name from Excel filename
-    playlist_name = os.path.splitext(os.path.basename(playlist_file))[0]
-    playlist_name = sanitize_filename(playlist_name)
-    output_m3u = os.path.join(playlist_dir, f"{playlist_name}.m3u")
+def is_playlist_column(col):
+    """Return True for columns that may hold the track path, title or artist"""
+    col_lower = str(col).lower()
+    return any(key in col_lower for key in ('path', 'file', 'location', 'title', 'artist'))
+
+def read_playlist_file(playlist_file):
+    """Parse a playlist Excel file into a list of track entries (None on error)"""
+    print(f"\nReading playlist: {os.path.basename(playlist_file)}")
     
     # Check if Excel file exists
     if not os.path.exists(playlist_file):
         print(f"Error: Playlist file not found: {playlist_file}")
-        return False
+        return None
     
     try:
-        # Load the Excel file
-        playlist_df = pd.read_excel(playlist_file)
+        # Load the Excel file, building only the path, title and artist columns
+        playlist_df = pd.read_excel(playlist_file, usecols=is_playlist_column)
         print(f"Loaded playlist with {len(playlist_df)} tracks")
         
         # Find path column
@@ -77,7 +86,7 @@ def process_playlist_file(playlist_file, mount_dir):
         if not path_column:
             print(f"Error: Could not find path column in {playlist_file}")
             print("Available columns:", playlist_df.columns.tolist())
-            return False
+            return None
         
         # Find title and artist columns if available
         title_column = None
@@ -95,101 +104,160 @@ def process_playlist_file(playlist_file, mount_dir):
         if artist_column:
             print(f"Using column '{artist_column}' for artists")
         
-        # Prepare to create M3U file
-        with open(output_m3u, 'w', encoding='utf-8') as m3u:
-            # Write M3U header
-            m3u.write("#EXTM3U\n")
+        entries = []
+        
+        # Process each track
+        for index, row in playlist_df.iterrows():
+            # Get track path
+            track_path = row.get(path_column)
+            
+            # Skip if path is missing
+            if pd.isna(track_path) or not track_path:
+                print(f"  Warning: Missing path for track at row {index+2}")
+                continue
             
-            # Track stats
-            processed_tracks = 0
-            copied_albums = set()
+            track_path = str(track_path)
             
-            # Process each track
-            for index, row in playlist_df.iterrows():
-                # Get track path
-                track_path = row.get(path_column)
-                
-                # Skip if path is missing
-                if pd.isna(track_path) or not track_path:
-                    print(f"  Warning: Missing path for track at row {index+2}")
-                    continue
-                
-                track_path = str(track_path)
-                
-                # Get album directory
-                album_path = os.path.dirname(track_path)
-                
-                # Skip if not in expected NAS paths
-                if not (album_path.startswith(NAS_ROOT_CD) or album_path.startswith(NAS_ROOT_HIRES)):
-                    print(f"  Warning: Track path not in expected NAS location: {track_path}")
-                    continue
-                
-                # Get title and artist if available
-                title = str(row.get(title_column, "")) if title_column and not pd.isna(row.get(title_column)) else os.path.basename(track_path)
-                artist = str(row.get(artist_column, "")) if artist_column and not pd.isna(row.get(artist_column)) else ""
-                
-                # Map paths from NAS to SDXC - using absolute paths for playlists
-                is_hires = album_path.startswith(NAS_ROOT_HIRES)
-                
-                if is_hires:
-                    rel_path = album_path[len(NAS_ROOT_HIRES):].lstrip('/')
-                    sdxc_album_path = os.path.join(sdxc_hires, rel_path)
-                    # Create absolute path for M3U
-                    sdxc_track_path = f"/MUSIC_SDXC/Hires/{track_path[len(NAS_ROOT_HIRES):].lstrip('/')}"
-                else:
-                    rel_path = album_path[len(NAS_ROOT_CD):].lstrip('/')
-                    sdxc_album_path = os.path.join(sdxc_cd, rel_path)
-                    # Create absolute path for M3U
-                    sdxc_track_path = f"/MUSIC_SDXC/CD/{track_path[len(NAS_ROOT_CD):].lstrip('/')}"
-                
-                # Copy album if not already copied
-                if album_path not in copied_albums:
-                    # Create target directory
-                    os.makedirs(os.path.dirname(sdxc_album_path), exist_ok=True)
-                    
-                    # Check if album already exists
-                    if os.path.exists(sdxc_album_path) and os.listdir(sdxc_album_path):
-                        print(f"  Album already exists: {sdxc_album_path}")
-                    else:
-                        print(f"  Copying album: {album_path}")
-                        
-                        # Escape special characters in paths
-                        album_path_escaped = album_path.replace("'", "'\\''")
-                        sdxc_album_path_escaped = sdxc_album_path.replace("'", "'\\''")
-                        
-                        # Build rsync command
-                        cmd = f"rsync -rtv --progress --no-owner --no-group '{album_path_escaped}/' '{sdxc_album_path_escaped}/'"
-                        
-                        # Execute rsync
-                        try:
-                            subprocess.run(cmd, shell=True, check=True)
-                            print(f"  Album copied successfully")
-                        except subprocess.CalledProcessError as e:
-                            print(f"  Error copying album: {e}")
-                    
-                    # Mark album as processed
-                    copied_albums.add(album_path)
-                
-                # Add track to playlist with absolute path
-                m3u.write(f"#EXTINF:-1,{artist} - {title}\n")
-                m3u.write(f"{sdxc_track_path}\n")
-                
-                processed_tracks += 1
-                
-                # Show progress
-                if (index + 1) % 10 == 0:
-                    print(f"  Processed {index + 1} tracks...")
+            # Get album directory
+            album_path = os.path.dirname(track_path)
+            
+            # Skip if not in expected NAS paths
+            if not (album_path.startswith(NAS_ROOT_CD) or album_path.startswith(NAS_ROOT_HIRES)):
+                print(f"  Warning: Track path not in expected NAS location: {track_path}")
+                continue
+            
+            # Get title and artist if available
+            title = str(row.get(title_column, "")) if title_column and not pd.isna(row.get(title_column)) else os.path.basename(track_path)
+            artist = str(row.get(artist_column, "")) if artist_column and not pd.isna(row.get(artist_column)) else ""
+            
+            # Map paths from NAS to SDXC - using absolute paths for playlists
+            is_hires = album_path.startswith(NAS_ROOT_HIRES)
+            
+            if is_hires:
+                rel_path = album_path[len(NAS_ROOT_HIRES):].lstrip('/')
+                card_album_dir = os.path.join("Music", "Hires", rel_path)
+                # Create absolute path for M3U
+                sdxc_track_path = f"/MUSIC_SDXC/Hires/{track_path[len(NAS_ROOT_HIRES):].lstrip('/')}"
+            else:
+                rel_path = album_path[len(NAS_ROOT_CD):].lstrip('/')
+                card_album_dir = os.path.join("Music", "CD", rel_path)
+                # Create absolute path for M3U
+                sdxc_track_path = f"/MUSIC_SDXC/CD/{track_path[len(NAS_ROOT_CD):].lstrip('/')}"
+            
+            entries.append({
+                'album_path': album_path,
+                'card_album_dir': card_album_dir,
+                'sdxc_track_path': sdxc_track_path,
+                'title': title,
+                'artist': artist
+            })
         
-        print(f"Created playlist: {output_m3u}")
-        print(f"Processed {processed_tracks} tracks and copied {len(copied_albums)} albums")
-        return True
+        print(f"Found {len(entries)} usable tracks")
+        return entries
     
     except Exception as e:
-        print(f"Error processing playlist {playlist_file}: {e}")
+        print(f"Error reading playlist {playlist_file}: {e}")
         import traceback
         traceback.print_exc()
+        return None
+
+def read_playlist_file_quietly(playlist_file):
+    """Parse a playlist in a worker process, returning (entries, captured output)"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        entries = read_playlist_file(playlist_file)
+    return entries, output.getvalue()
+
+def read_all_playlist_files(playlist_files):
+    """Parse all playlist workbooks in a process pool, returning (file, entries) pairs"""
+    workers = max(1, min(PARSE_WORKERS, len(playlist_files)))
+    print(f"Reading {len(playlist_files)} playlists with {workers} worker processes...")
+    start = time.time()
+    
+    playlists = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() keeps the input order, so each playlist's log stays together
+        for playlist_file, (entries, output) in zip(playlist_files, executor.map(read_playlist_file_quietly, playlist_files)):
+            print(output, end='')
+            if entries is not None:
+                playlists.append((playlist_file, entries))
+    
+    print(f"\nRead {len(playlists)} playlists in {time.time() - start:.1f}s")
+    return playlists
+
+def write_playlist_m3u(playlist_file, entries, playlist_dir, playlist_writer):
+    """Write the M3U playlist for a parsed playlist file, unless it is unchanged"""
+    # Generate output playlist name from Excel filename
+    playlist_name = os.path.splitext(os.path.basename(playlist_file))[0]
+    playlist_name = sanitize_filename(playlist_name)
+    output_m3u = os.path.join(playlist_dir, f"{playlist_name}.m3u")
+    
+    try:
+        # Add tracks to playlist with absolute paths
+        if playlist_writer.write(output_m3u, [(entry['artist'], entry['title'], entry['sdxc_track_path'])
+                                              for entry in entries]):
+            print(f"Created playlist: {output_m3u} ({len(entries)} tracks)")
+        else:
+            print(f"Playlist unchanged: {output_m3u} ({len(entries)} tracks)")
+        return True
+    
+    except Exception as e:
+        print(f"Error writing playlist {output_m3u}: {e}")
         return False
 
+def build_copy_plan(playlists, mount_dir):
+    """Build one deduplicated list of album copies for all playlists"""
+    # Albums in first-seen order across every playlist
+    albums = {}
+    for playlist_file, entries in playlists:
+        for entry in entries:
+            albums.setdefault(entry['album_path'], entry['card_album_dir'])
+    
+    print(f"\nPlanning copies for {len(albums)} unique albums from {len(playlists)} playlists...")
+    
+    # Existing card files come from the inventory, so only the NAS side is stat'ed
+    inventory = load_card_inventory(mount_dir)
+    
+    def plan_album(item):
+        album_path, card_album_dir = item
+        if not os.path.isdir(album_path):
+            return album_path, card_album_dir, None
+        return album_path, card_album_dir, find_pending_files(album_path, os.path.join(mount_dir, card_album_dir), inventory, mount_dir)
+    
+    plan = []
+    skipped = 0
+    missing = 0
+    total_bytes = 0
+    total_files = 0
+    
+    # NAS stats are latency bound, so plan several albums at once
+    with ThreadPoolExecutor(max_workers=PLAN_WORKERS) as executor:
+        for album_path, card_album_dir, pending in executor.map(plan_album, albums.items()):
+            if pending is None:
+                print(f"  Warning: Album not found on NAS: {album_path}")
+                missing += 1
+            elif not pending:
+                skipped += 1
+            else:
+                album_bytes = sum(size for _, size in pending)
+                plan.append({
+                    'album_path': album_path,
+                    'sdxc_album_path': os.path.join(mount_dir, card_album_dir),
+                    'pending': pending,
+                    'bytes': album_bytes
+                })
+                total_bytes += album_bytes
+                total_files += len(pending)
+    
+    print("Copy plan:")
+    print(f"  Albums already complete on card (skipped): {skipped}")
+    print(f"  Albums to copy: {len(plan)} ({total_files} files)")
+    print(f"  Total to copy: {total_bytes / (1024*1024*1024):.2f} GB ({total_bytes:,} bytes)")
+    if missing:
+        print(f"  Albums missing on NAS: {missing}")
+    
+    return plan
+
 def process_all_playlists(playlists_dir, mount_dir):
     """Process all Excel files in the playlists directory"""
     print(f"Processing all playlists in: {playlists_dir}")
@@ -203,14 +271,35 @@ def process_all_playlists(playlists_dir, mount_dir):
         return 0
     
     print(f"Found {len(playlist_files)} playlist files")
+    sdxc_cd, sdxc_hires, playlist_dir = ensure_directories_exist(mount_dir)
     
-    # Process each playlist file
+    # Step 1: Parse every playlist workbook (in parallel across cores)
+    playlists = read_all_playlist_files(playlist_files)
+    
+    # Step 2: Plan all album copies once, before any copying starts
+    plan = build_copy_plan(playlists, mount_dir)
+    
+    # Step 3: Run the plan; M3U files are written while the copies run
+    copy_engine = CopyEngine()
+    playlist_writer = PlaylistWriter()
     successful = 0
-    for playlist_file in playlist_files:
-        if process_playlist_file(playlist_file, mount_dir):
-            successful += 1
+    try:
+        for album in plan:
+            copy_engine.submit(album['album_path'], album['sdxc_album_path'], pending=album['pending'])
+        
+        print("\nWriting playlists...")
+        for playlist_file, entries in playlists:
+            if write_playlist_m3u(playlist_file, entries, playlist_dir, playlist_writer):
+                successful += 1
+        
+        if plan:
+            print("\nWaiting for album copies to finish...")
+            copy_engine.wait()
+    finally:
+        copy_engine.shutdown()
     
     print(f"\nSuccessfully processed {successful} of {len(playlist_files)} playlists")
+    playlist_writer.print_stats()
     return successful
 
 def main():
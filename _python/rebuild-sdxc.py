@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+"""
+SDXC Card Rebuild Engine
+------------------------
+This script:
+1. Reads every album from a snapshot file in one pass
+2. Checks that the source albums exist on the NAS with parallel stats
+3. Copies the albums to the SDXC card with the shared copy engine
+4. Records each finished album in a journal on the host, so a resumed
+   rebuild skips finished albums without rescanning them
+
+In sync mode the snapshot is compared with the live card and the NAS instead,
+and only the changed files are copied or deleted. The exact byte delta is
+reported before anything is changed.
+
+Called by rebuild_sdxc.sh.
+Usage: python rebuild-sdxc.py <snapshot_file> <mount_directory> [resume|sync]
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from card_capacity import get_card_capacity, round_to_clusters
+from card_inventory import list_subdirs, load_card_inventory
+from card_snapshot import ALBUM_TYPES, file_crc32, get_album_files, read_snapshot
+from clutter_policy import walk_album_files
+from copy_engine import CopyEngine
+from user_paths import CACHE_DIR
+
+# Configuration
+JOURNAL_DIR = CACHE_DIR
+STAT_WORKERS = 16  # Parallel source checks on the NAS
+
+def get_journal_path(snapshot_file, mount_dir):
+    """Return the journal file for rebuilding this card from this snapshot"""
+    key = os.path.realpath(snapshot_file) + "|" + os.path.realpath(mount_dir)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(snapshot_file))[0]
+    return os.path.join(JOURNAL_DIR, f"rebuild_{stem}_{digest}.journal")
+
+def read_journal(journal_path):
+    """Return the set of NAS album paths already copied"""
+    if not os.path.exists(journal_path):
+        return set()
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+class RebuildJournal:
+    """Append-only record of finished albums, synced to disk after every entry"""
+
+    def __init__(self, journal_path, reset=False):
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = open(journal_path, 'w' if reset else 'a', encoding='utf-8')
+
+    def record(self, album_path):
+        """Mark an album as finished"""
+        with self.lock:
+            self.file.write(album_path + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def rebuild_from_snapshot(snapshot_file, mount_dir, resume=False):
+    """Copy every album in the snapshot to the card, returning (copied, total)"""
+    # Step 1: Parse the snapshot in one pass
+    albums = read_snapshot(snapshot_file)
+    total_count = len(albums)
+    print(f"Snapshot lists {total_count} albums")
+
+    # Step 2: Skip albums finished by an earlier run
+    journal_path = get_journal_path(snapshot_file, mount_dir)
+    finished = read_journal(journal_path) if resume else set()
+    if resume:
+        print(f"Resume mode: {len(finished)} albums already finished according to {journal_path}")
+    todo = [album for album in albums if album['nas_path'] not in finished]
+
+    # Step 3: Check the sources exist, with stats running in parallel
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=STAT_WORKERS) as executor:
+        exists = list(executor.map(os.path.isdir, [album['nas_path'] for album in todo]))
+    missing = [album['nas_path'] for album, ok in zip(todo, exists) if not ok]
+    todo = [album for album, ok in zip(todo, exists) if ok]
+    for path in missing:
+        print(f"Warning: Source path does not exist: {path}")
+    print(f"Checked {len(exists)} source albums in {time.time() - start:.1f}s "
+          f"({len(missing)} missing, {len(todo)} to copy)")
+
+    # Step 4: Copy with a bounded worker pool, journaling each finished album
+    journal = RebuildJournal(journal_path, reset=not resume)
+    copy_engine = CopyEngine()
+    futures = []
+    try:
+        for album in todo:
+            path = album['nas_path']
+            future = copy_engine.submit(path, os.path.join(mount_dir, album['card_dir']),
+                                        f"{album['type']} album: {os.path.basename(path)}")
+            future.add_done_callback(lambda f, path=path: f.result() and journal.record(path))
+            futures.append(future)
+
+        copied, failed, copied_bytes = copy_engine.wait()
+    finally:
+        copy_engine.shutdown()
+        journal.close()
+
+    # Albums that were already complete on the card count as finished too
+    success_count = len(finished) + sum(1 for future in futures if future.result())
+    print("Copy process complete.")
+    print(f"Successfully copied {success_count} of {total_count} albums.")
+    if failed:
+        print(f"{failed} albums failed; run again with 'resume' to retry them")
+    return success_count, total_count
+
+def scan_nas_album(nas_path):
+    """Return {relative path: (size, mtime_ns)} for an album on the NAS, or None if missing"""
+    if not os.path.isdir(nas_path):
+        return None
+    files = {}
+    for path, rel_path in walk_album_files(nas_path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files[rel_path] = (st.st_size, st.st_mtime_ns)
+    return files
+
+def stat_card_album(inventory, card_album_dir, mount_dir):
+    """Return {relative path: [size, mtime_ns]} for a card album, re-stat'ing the inventory's files
+
+    A file changed in place (for example truncated) keeps its directory's mtime,
+    so the sizes the inventory reused from its manifest may be stale.
+    """
+    album_path = os.path.join(mount_dir, card_album_dir)
+    files = {}
+    for rel_path in get_album_files(inventory, card_album_dir, mount_dir):
+        try:
+            st = os.stat(os.path.join(album_path, rel_path))
+        except OSError:
+            continue
+        files[rel_path] = [st.st_size, st.st_mtime_ns]
+    return files
+
+def same_file(a, b):
+    """Quick check used by rsync -t: same size and whole-second mtime"""
+    return a[0] == b[0] and a[1] // 1_000_000_000 == b[1] // 1_000_000_000
+
+def plan_album_sync(album, nas_files, card_files, mount_dir):
+    """Work out which files of one album must be copied, re-timed or deleted"""
+    card_album_path = os.path.join(mount_dir, album['card_dir'])
+    snapshot_files = album['files']
+    plan = {'copy': [], 'touch': [], 'delete': [], 'replaced': [], 'nas_changed': 0}
+
+    for rel_path, nas_entry in nas_files.items():
+        snap_entry = snapshot_files.get(rel_path) if snapshot_files is not None else None
+        if snapshot_files is not None and (snap_entry is None or not same_file(snap_entry, nas_entry)):
+            plan['nas_changed'] += 1
+
+        card_entry = card_files.get(rel_path)
+        if card_entry is not None and same_file(card_entry, nas_entry):
+            continue
+
+        # Same size but a different mtime: if the NAS file is unchanged since
+        # the snapshot and the card file still has the recorded checksum, only
+        # the mtime needs fixing
+        if (card_entry is not None and card_entry[0] == nas_entry[0] and snap_entry is not None
+                and snap_entry[2] and same_file(snap_entry, nas_entry)):
+            card_path = os.path.join(card_album_path, rel_path)
+            try:
+                if file_crc32(card_path) == snap_entry[2]:
+                    plan['touch'].append((card_path, nas_entry[1]))
+                    continue
+            except OSError:
+                pass
+
+        plan['copy'].append((os.path.join(album['nas_path'], rel_path), nas_entry[0]))
+        if card_entry is not None:
+            plan['replaced'].append(card_entry[0])
+
+    if snapshot_files is not None:
+        plan['nas_changed'] += sum(1 for rel_path in snapshot_files if rel_path not in nas_files)
+
+    for rel_path, card_entry in card_files.items():
+        if rel_path not in nas_files:
+            plan['delete'].append((os.path.join(card_album_path, rel_path), card_entry[0]))
+
+    return plan
+
+def remove_empty_parents(path, stop_dir):
+    """Remove empty directories from path's parent up to (not including) stop_dir"""
+    parent = os.path.dirname(path)
+    while parent != stop_dir and parent.startswith(stop_dir):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+def sync_from_snapshot(snapshot_file, mount_dir):
+    """Bring the card in line with the snapshot and the NAS, copying only changed files
+
+    Returns True if every change was applied.
+    """
+    albums = read_snapshot(snapshot_file)
+    print(f"Snapshot lists {len(albums)} albums")
+    inventory = load_card_inventory(mount_dir)
+    capacity = get_card_capacity(mount_dir)
+    cluster_size = capacity['cluster_size']
+
+    # Step 1: Scan the NAS albums in parallel
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=STAT_WORKERS) as executor:
+        nas_albums = list(executor.map(scan_nas_album, [album['nas_path'] for album in albums]))
+    print(f"Scanned {len(albums)} NAS albums in {time.time() - start:.1f}s")
+
+    # Step 2: Compare every album with the card
+    plans = []
+    missing = 0
+    unchanged = 0
+    nas_changed_albums = 0
+    for album, nas_files in zip(albums, nas_albums):
+        if nas_files is None:
+            print(f"Warning: Source path does not exist, leaving card album as is: {album['nas_path']}")
+            missing += 1
+            continue
+        card_files = stat_card_album(inventory, album['card_dir'], mount_dir)
+        plan = plan_album_sync(album, nas_files, card_files, mount_dir)
+        if plan['nas_changed']:
+            nas_changed_albums += 1
+        if plan['copy'] or plan['touch'] or plan['delete']:
+            plans.append((album, plan))
+        else:
+            unchanged += 1
+
+    # Albums on the card that are not in the snapshot are removed entirely
+    wanted_dirs = {album['card_dir'] for album in albums}
+    extra_albums = []
+    for _, card_dir, _ in ALBUM_TYPES:
+        for album_name in list_subdirs(inventory, card_dir):
+            card_album_dir = f"{card_dir}/{album_name}"
+            if card_album_dir not in wanted_dirs:
+                files = get_album_files(inventory, card_album_dir, mount_dir)
+                extra_albums.append((card_album_dir, files))
+
+    # Step 3: Report the exact delta before changing anything
+    copy_files = sum(len(plan['copy']) for _, plan in plans)
+    copy_bytes = sum(size for _, plan in plans for _, size in plan['copy'])
+    delete_files = sum(len(plan['delete']) for _, plan in plans) + sum(len(files) for _, files in extra_albums)
+    delete_bytes = (sum(size for _, plan in plans for _, size in plan['delete'])
+                    + sum(size for _, files in extra_albums for size, _ in files.values()))
+    touch_files = sum(len(plan['touch']) for _, plan in plans)
+
+    # Space freed by files that are replaced or deleted, in whole clusters
+    freed_alloc = sum(round_to_clusters(size, cluster_size)
+                      for _, plan in plans for size in plan['replaced'] + [size for _, size in plan['delete']])
+    freed_alloc += sum(round_to_clusters(size, cluster_size)
+                       for _, files in extra_albums for size, _ in files.values())
+    copy_alloc = sum(round_to_clusters(size, cluster_size) for _, plan in plans for _, size in plan['copy'])
+
+    gb = 1024 * 1024 * 1024
+    print("\nSync plan:")
+    print(f"  Albums unchanged: {unchanged}, to update: {len(plans)}, "
+          f"to remove: {len(extra_albums)}, missing on NAS: {missing}")
+    if nas_changed_albums:
+        print(f"  Albums changed on the NAS since the snapshot: {nas_changed_albums}")
+    print(f"  Copy: {copy_files} files, {copy_bytes} bytes ({copy_bytes / gb:.2f} GB)")
+    print(f"  Delete: {delete_files} files, {delete_bytes} bytes ({delete_bytes / gb:.2f} GB)")
+    if touch_files:
+        print(f"  Fix mtime only (checksum matches): {touch_files} files")
+
+    net_alloc = copy_alloc - freed_alloc
+    if net_alloc > capacity['usable_bytes']:
+        print(f"Error: Sync needs {net_alloc / gb:.2f} GB more space but only "
+              f"{capacity['usable_bytes'] / gb:.2f} GB is usable on the card")
+        return False
+
+    # Step 4: Delete first so the copies have room, then fix mtimes
+    delete_failures = 0
+
+    def report_remove_error(function, path, exc_info):
+        nonlocal delete_failures
+        delete_failures += 1
+        print(f"  Warning: Could not delete {path}: {exc_info[1]}")
+
+    for card_album_dir, _ in extra_albums:
+        print(f"  Removing album not in snapshot: {card_album_dir}")
+        shutil.rmtree(os.path.join(mount_dir, card_album_dir), onerror=report_remove_error)
+    for album, plan in plans:
+        card_album_path = os.path.join(mount_dir, album['card_dir'])
+        for card_path, _ in plan['delete']:
+            try:
+                os.remove(card_path)
+                remove_empty_parents(card_path, card_album_path)
+            except OSError as e:
+                delete_failures += 1
+                print(f"  Warning: Could not delete {card_path}: {e}")
+        for card_path, mtime_ns in plan['touch']:
+            try:
+                os.utime(card_path, ns=(mtime_ns, mtime_ns))
+            except OSError as e:
+                print(f"  Warning: Could not set mtime of {card_path}: {e}")
+
+    # Step 5: Copy the changed files
+    copy_engine = CopyEngine()
+    try:
+        for album, plan in plans:
+            if plan['copy']:
+                copy_engine.submit(album['nas_path'], os.path.join(mount_dir, album['card_dir']),
+                                   f"{album['type']} album: {os.path.basename(album['nas_path'])}",
+                                   pending=plan['copy'])
+        copied, failed, copied_bytes = copy_engine.wait()
+    finally:
+        copy_engine.shutdown()
+
+    if delete_failures:
+        print(f"Sync incomplete: {delete_failures} files or directories could not be deleted")
+        return False
+    print("Sync complete.")
+    return failed == 0
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python rebuild-sdxc.py <snapshot_file> <mount_directory> [resume|sync]")
+        sys.exit(1)
+
+    snapshot_file = sys.argv[1]
+    mount_dir = sys.argv[2]
+    mode = sys.argv[3] if len(sys.argv) > 3 else None
+
+    if not os.path.isfile(snapshot_file):
+        print(f"Error: Snapshot file {snapshot_file} does not exist")
+        sys.exit(1)
+
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+
+    if mode == "sync":
+        if not sync_from_snapshot(snapshot_file, mount_dir):
+            sys.exit(1)
+        return
+
+    success_count, total_count = rebuild_from_snapshot(snapshot_file, mount_dir, mode == "resume")
+    if success_count < total_count:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""
+Columnar Track Store
+--------------------
+Holds the tracks on the card as columns instead of one dict per track:
+- artist, album and genre are interned: each distinct name is stored once and
+  tracks hold an integer code into the list of names
+- numeric fields (track number, duration, sample rate, bit depth, year, the
+  hires flag, play count, and the measured energy, loudness and tempo) are
+  NumPy arrays; measurements are NaN until the track has been analysed
+- paths and titles stay plain Python lists
+
+Tracks are added one by one while scanning and the columns are built with
+finalize(). Selection then works on boolean masks and index arrays, for
+example:
+
+    rows = store.indices(store.mask(genre=["Jazz", "Acid Jazz"], play_count=(0, 0)))
+
+Used by playlist-generator.py.
+"""
+
+import numpy as np
+
+# Interned text fields and numeric fields with their array types
+CODE_FIELDS = ('artist', 'album', 'genre')
+NUMERIC_FIELDS = {
+    'track_number': np.int32,
+    'duration': np.float32,
+    'sample_rate': np.int32,
+    'bit_depth': np.int16,
+    'year': np.int16,
+    'is_hires': np.bool_,
+    'play_count': np.int64,
+    'energy': np.float32,
+    'loudness': np.float32,
+    'tempo': np.float32,
+}
+
+class TrackStore:
+    """Column-oriented table of tracks with interned artist, album and genre names"""
+
+    def __init__(self):
+        self.paths = []
+        self.titles = []
+        self.names = {field: [] for field in CODE_FIELDS}
+        self._codes_by_name = {field: {} for field in CODE_FIELDS}
+        self._pending = {field: [] for field in CODE_FIELDS + tuple(NUMERIC_FIELDS)}
+        self.columns = {}
+        self.row_by_path = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, field):
+        """Return a column: codes for artist/album/genre, values for numeric fields"""
+        return self.columns[field]
+
+    def code(self, field, name):
+        """Return the code of a name in an interned field, or -1 if no track has it"""
+        return self._codes_by_name[field].get(name, -1)
+
+    def _intern(self, field, name):
+        codes = self._codes_by_name[field]
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(self.names[field])
+            self.names[field].append(name)
+        return code
+
+    def add(self, path, title, artist, album, genre, track_number=0, duration=0, sample_rate=0,
+            bit_depth=0, year=0, is_hires=False, play_count=0, energy=np.nan, loudness=np.nan, tempo=np.nan):
+        """Append a track; call finalize() once all tracks are added"""
+        self.row_by_path[path] = len(self.paths)
+        self.paths.append(path)
+        self.titles.append(title)
+        pending = self._pending
+        pending['artist'].append(self._intern('artist', artist))
+        pending['album'].append(self._intern('album', album))
+        pending['genre'].append(self._intern('genre', genre))
+        pending['track_number'].append(track_number)
+        pending['duration'].append(duration)
+        pending['sample_rate'].append(sample_rate)
+        pending['bit_depth'].append(bit_depth)
+        pending['year'].append(year)
+        pending['is_hires'].append(is_hires)
+        pending['play_count'].append(play_count)
+        pending['energy'].append(energy)
+        pending['loudness'].append(loudness)
+        pending['tempo'].append(tempo)
+
+    def finalize(self):
+        """Turn the added tracks into NumPy columns"""
+        for field in CODE_FIELDS:
+            self.columns[field] = np.array(self._pending[field], dtype=np.int32)
+        for field, dtype in NUMERIC_FIELDS.items():
+            self.columns[field] = np.array(self._pending[field], dtype=dtype)
+        self._pending = {field: [] for field in self._pending}
+
+    def set_column(self, field, values):
+        """Replace a numeric column, for example play counts loaded after the scan"""
+        values = np.asarray(values, dtype=NUMERIC_FIELDS[field])
+        if len(values) != len(self.paths):
+            raise ValueError(f"Column {field} has {len(values)} values for {len(self.paths)} tracks")
+        self.columns[field] = values
+
+    def decades(self):
+        """Return the decade of every track (1990 for 1994), or -1 if the year is unknown"""
+        year = self.columns['year'].astype(np.int32)
+        return np.where(year > 0, year // 10 * 10, -1)
+
+    def mask(self, **conditions):
+        """Return a boolean mask of the tracks matching every condition
+
+        Interned fields take a name or a list of names; numeric fields take a
+        value or an inclusive (min, max) range.
+        """
+        result = np.ones(len(self.paths), dtype=bool)
+        for field, condition in conditions.items():
+            column = self.columns[field]
+            if field in CODE_FIELDS:
+                names = [condition] if isinstance(condition, str) else condition
+                codes = [self.code(field, name) for name in names]
+                result &= np.isin(column, [code for code in codes if code >= 0])
+            elif isinstance(condition, tuple):
+                low, high = condition
+                result &= (column >= low) & (column <= high)
+            else:
+                result &= column == condition
+        return result
+
+    def indices(self, mask):
+        """Return the rows selected by a mask, in store order"""
+        return np.flatnonzero(mask)
+
+    def value(self, field, row):
+        """Return one track's value of a field (the name for interned fields)"""
+        if field == 'path':
+            return self.paths[row]
+        if field == 'title':
+            return self.titles[row]
+        value = self.columns[field][row]
+        if field in CODE_FIELDS:
+            return self.names[field][value]
+        return value.item()
+
+    def track(self, row):
+        """Return one track as a dict, for reporting"""
+        track = {'path': self.paths[row], 'title': self.titles[row]}
+        for field in CODE_FIELDS + tuple(NUMERIC_FIELDS):
+            track[field] = self.value(field, row)
+        return track
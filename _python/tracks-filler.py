@@ -7,42 +7,48 @@ This script uses the track-level data to fill the SDXC card.
 Updated to use the new directory structure and handle relative paths.
 """
 
+import bisect
 import os
 import sys
+import numpy as np
 import pandas as pd
-import random
 import time
 from pathlib import Path
-from collections import defaultdict
+
+import file_copier
+from card_capacity import dir_entries_size, get_card_capacity, print_capacity, round_to_clusters
+from card_inventory import iter_dirs, iter_files, load_card_inventory
+from clutter_policy import RSYNC_EXCLUDES, is_clutter_path
+from library_cache import get_library_columns, load_library_tracks
+from metadata_cache import MetadataCache
 
 # Configuration
 NAS_ROOT_CD = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
 NAS_ROOT_HIRES = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
-MAX_SIZE = 2000000000000  # 2TB in bytes
+
+# Packing planner weights (value of an album = base + play count + artist variety)
+ALBUM_WEIGHT = 1.0  # Every album counts, so smaller albums give more variety per GB
+PLAY_COUNT_WEIGHT = 1.0  # Applied to log(1 + play count)
+VARIETY_WEIGHT = 1.0  # Divided by the number of candidate albums by the same artist
+MAX_PLANNER_SWAPS = 10000
+
+# Set SP3000_FILL_FROM_TAGS=1 to fill albums without an artist or genre in the
+# library from the tags of their first track (reads a file on the NAS per album)
+FILL_FROM_TAGS = os.environ.get("SP3000_FILL_FROM_TAGS") == "1"
+
+# Columns of the album table returned by get_albums_from_tracks
+ALBUM_COLUMNS = ['path', 'artist', 'album', 'album_artist', 'genre', 'size', 'alloc_size', 'play_count', 'track_count']
 
 def get_sdxc_usage(mount_dir):
     """Calculate current SDXC card usage"""
-    # New Music directory structure
-    cd_dir = os.path.join(mount_dir, "Music", "CD")
-    hires_dir = os.path.join(mount_dir, "Music", "Hires")
-    
     try:
+        # Sizes come from the shared card inventory instead of walking the card again
+        inventory = load_card_inventory(mount_dir)
+        
         total_size = 0
-        # Walk through CD directory
-        if os.path.exists(cd_dir):
-            for dirpath, dirnames, filenames in os.walk(cd_dir):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if not os.path.islink(fp):
-                        total_size += os.path.getsize(fp)
-        
-        # Walk through HiRes directory
-        if os.path.exists(hires_dir):
-            for dirpath, dirnames, filenames in os.walk(hires_dir):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if not os.path.islink(fp):
-                        total_size += os.path.getsize(fp)
+        for top in (os.path.join("Music", "CD"), os.path.join("Music", "Hires")):
+            for path, size, mtime_ns in iter_files(inventory, top):
+                total_size += size
         
         return total_size
     except Exception as e:
@@ -53,13 +59,15 @@ def get_copied_albums(mount_dir):
     """Get list of albums already on the SDXC card"""
     copied_albums = set()
     
+    inventory = load_card_inventory(mount_dir)
+    
     # New Music directory structure
     cd_dir = os.path.join(mount_dir, "Music", "CD")
     hires_dir = os.path.join(mount_dir, "Music", "Hires")
     
-    # Check CD directory
-    if os.path.exists(cd_dir):
-        for root, dirs, files in os.walk(cd_dir):
+    for sdxc_dir, nas_root in ((cd_dir, NAS_ROOT_CD), (hires_dir, NAS_ROOT_HIRES)):
+        top = os.path.relpath(sdxc_dir, mount_dir)
+        for root, files in iter_dirs(inventory, top, mount_dir):
             # If it has music files, consider it an album directory
             has_music = False
             for f in files:
@@ -68,23 +76,8 @@ def get_copied_albums(mount_dir):
                     break
             
             if has_music:
-                rel_path = os.path.relpath(root, cd_dir)
-                nas_path = os.path.join(NAS_ROOT_CD, rel_path)
-                copied_albums.add(nas_path)
-    
-    # Check HiRes directory
-    if os.path.exists(hires_dir):
-        for root, dirs, files in os.walk(hires_dir):
-            # If it has music files, consider it an album directory
-            has_music = False
-            for f in files:
-                if f.lower().endswith(('.flac', '.mp3', '.wav', '.aiff', '.alac', '.dsf', '.dff')):
-                    has_music = True
-                    break
-            
-            if has_music:
-                rel_path = os.path.relpath(root, hires_dir)
-                nas_path = os.path.join(NAS_ROOT_HIRES, rel_path)
+                rel_path = os.path.relpath(root, sdxc_dir)
+                nas_path = os.path.join(nas_root, rel_path)
                 copied_albums.add(nas_path)
     
     print(f"Found {len(copied_albums)} albums already on SDXC card")
@@ -94,27 +87,71 @@ def get_copied_albums(mount_dir):
     
     return copied_albums
 
-def get_albums_from_tracks(track_file):
-    """Extract albums from the tracks Excel file"""
-    all_albums = {}
+def fill_missing_details(all_albums, first_track_paths, metadata_cache):
+    """Fill empty artist and genre fields from the tags of each album's first track
+    
+    Only the fields the planner uses are filled. Tags come from the metadata
+    cache, so a track on the NAS is only opened again when its size or mtime changed.
+    """
+    fields = ['artist', 'genre']
+    details = all_albums[fields].fillna('').astype(str)
+    missing = all_albums.index[(details == '').any(axis=1)]
+    if len(missing) == 0:
+        return
+    
+    entries = []
+    for album_path in missing:
+        track_path = first_track_paths[album_path]
+        try:
+            st = os.stat(track_path)
+        except OSError:
+            continue
+        entries.append((track_path, st.st_size, st.st_mtime_ns))
+    track_tags = metadata_cache.get_tags(entries)
+    
+    filled = 0
+    for album_path in missing:
+        tags = track_tags.get(first_track_paths[album_path])
+        if not tags:
+            continue
+        for field in fields:
+            if details.at[album_path, field] == '' and tags.get(field):
+                all_albums.at[album_path, field] = tags[field]
+        filled += 1
+    print(f"Filled missing album details from tags for {filled} of {len(missing)} albums")
+
+def get_albums_from_tracks(track_file, cluster_size=1, metadata_cache=None):
+    """Extract albums from the tracks Excel file as a table with one row per album
+    
+    alloc_size is the space the album takes on a card with the given cluster size:
+    every track rounded up to whole clusters plus the album directory's entries.
+    If a metadata cache is given, empty album details are filled from track tags.
+    """
+    all_albums = pd.DataFrame(columns=ALBUM_COLUMNS)
     
     try:
-        # Load from tracks file
+        # Load from tracks file (via the columnar library cache)
         print(f"Loading track data from: {track_file}")
-        tracks_df = pd.read_excel(track_file)
-        print(f"Loaded {len(tracks_df)} tracks")
+        columns = get_library_columns(track_file)
         
         # Debug: Show column names
-        print("Excel columns:", tracks_df.columns.tolist())
+        print("Excel columns:", columns)
         
         # Check for path column
         path_column = None
-        for col in tracks_df.columns:
+        for col in columns:
             if 'path' in str(col).lower() or 'file' in str(col).lower() or 'location' in str(col).lower():
                 path_column = col
                 print(f"Found path column: '{path_column}'")
                 break
         
+        if path_column:
+            # Only load the columns used for album aggregation
+            tracks_df = load_library_tracks(track_file, [path_column, 'Artist', 'Album', 'AlbumArtist', 'Genre', 'Size', 'PlayCount'])
+        else:
+            tracks_df = load_library_tracks(track_file)
+        print(f"Loaded {len(tracks_df)} tracks")
+        
         if not path_column:
             print("WARNING: No path column found in track data!")
             # Try to find something that looks like a path
@@ -132,93 +169,105 @@ def get_albums_from_tracks(track_file):
                 sample = tracks_df[col].iloc[0] if not tracks_df.empty else None
                 if isinstance(sample, str):
                     print(f"  String column: '{col}' - Sample: '{sample}'")
-            return {}
+            return all_albums
         
-        # Group tracks by album
-        album_tracks = defaultdict(list)
-        album_info = {}
+        # Drop rows without a path
+        has_path = tracks_df[path_column].notna() & (tracks_df[path_column].astype(str) != '')
+        no_path_rows = tracks_df.index[~has_path]
+        no_path_count = len(no_path_rows)
+        for i in no_path_rows[:5]:
+            print(f"Row {i} has no path")
         
-        track_count = 0
-        no_path_count = 0
-        wrong_path_count = 0
+        tracks_df = tracks_df[has_path]
+        paths = tracks_df[path_column].astype(str)
         
-        for i, track in tracks_df.iterrows():
-            path = track.get(path_column, '')
-            
-            # Debug every 1000 rows
-            if i % 1000 == 0 and i > 0:
-                print(f"Processing row {i}, found {len(album_tracks)} albums so far")
-            
-            if pd.isna(path) or not path:
-                no_path_count += 1
-                if no_path_count <= 5:
-                    print(f"Row {i} has no path")
-                continue
-            
-            # Debug path format
-            if i < 5:
-                print(f"Row {i} path: '{path}'")
-            
-            # Extract album path (parent directory)
-            album_path = os.path.dirname(path)
-            
-            # Check path format
-            if not (album_path.startswith(NAS_ROOT_CD) or album_path.startswith(NAS_ROOT_HIRES)):
-                wrong_path_count += 1
-                if wrong_path_count <= 5:
-                    print(f"Row {i} has wrong album path format: '{album_path}'")
-                continue
-            
-            # Add track to album
-            album_tracks[album_path].append(path)
-            
-            # Update album info
-            if album_path not in album_info:
-                album_info[album_path] = {
-                    'path': album_path,
-                    'artist': track.get('Artist', ''),
-                    'album': track.get('Album', ''),
-                    'album_artist': track.get('AlbumArtist', ''),
-                    'genre': track.get('Genre', ''),
-                    'size': 0,
-                    'play_count': 0
-                }
-            
-            # Update size
-            size = track.get('Size', 0)
-            if not pd.isna(size) and size > 0:
-                album_info[album_path]['size'] += size
-            
-            # Update play count
-            play_count = track.get('PlayCount', 0)
-            if not pd.isna(play_count) and play_count > 0:
-                album_info[album_path]['play_count'] += play_count
-            
-            track_count += 1
+        # Debug path format
+        for i, path in paths[paths.index < 5].items():
+            print(f"Row {i} path: '{path}'")
         
-        # Create final album list
-        for album_path, tracks in album_tracks.items():
-            all_albums[album_path] = album_info[album_path]
-            
-            # If album has no size yet, try to get it from file system
-            if all_albums[album_path]['size'] == 0:
+        # Extract album path (parent directory), equivalent to os.path.dirname
+        parts = paths.str.rpartition('/')
+        heads = parts[0] + parts[1]
+        album_paths = heads.str.rstrip('/')
+        album_paths = album_paths.where((album_paths != '') | (heads == ''), heads)
+        
+        # Check path format
+        in_roots = album_paths.str.startswith(NAS_ROOT_CD) | album_paths.str.startswith(NAS_ROOT_HIRES)
+        wrong_path_count = int((~in_roots).sum())
+        for i, album_path in album_paths[~in_roots].head(5).items():
+            print(f"Row {i} has wrong album path format: '{album_path}'")
+        
+        # Clutter is never copied, so only count the bytes that will be written
+        clutter = paths.map(is_clutter_path)
+        clutter_count = int((in_roots & clutter).sum())
+        keep = in_roots & ~clutter
+        
+        # Only positive sizes and play counts contribute to album totals
+        tracks_df = tracks_df[keep].assign(_album_path=album_paths[keep], _track_path=paths[keep])
+        for column, total_column in (('Size', '_size'), ('PlayCount', '_play_count')):
+            if column in tracks_df.columns:
+                values = pd.to_numeric(tracks_df[column], errors='coerce')
+                tracks_df[total_column] = values.where(values > 0, 0)
+            else:
+                tracks_df[total_column] = 0
+        
+        # Space each track really takes: whole clusters plus its directory entries
+        name_lengths = tracks_df['_track_path'].str.rpartition('/')[2].str.len()
+        tracks_df['_alloc_size'] = round_to_clusters(tracks_df['_size'].astype('int64'), cluster_size)
+        tracks_df['_entries_size'] = dir_entries_size(name_lengths)
+        
+        # Sum sizes and play counts per album, keeping first-seen album order
+        grouped = tracks_df.groupby('_album_path', sort=False)
+        totals = grouped[['_size', '_alloc_size', '_entries_size', '_play_count']].sum()
+        dir_overhead = round_to_clusters(totals['_entries_size'], cluster_size)
+        
+        # Album details come from the first track of each album
+        first_tracks = tracks_df.drop_duplicates('_album_path').set_index('_album_path')
+        
+        all_albums = pd.DataFrame({
+            'path': totals.index,
+            'artist': first_tracks['Artist'] if 'Artist' in first_tracks.columns else '',
+            'album': first_tracks['Album'] if 'Album' in first_tracks.columns else '',
+            'album_artist': first_tracks['AlbumArtist'] if 'AlbumArtist' in first_tracks.columns else '',
+            'genre': first_tracks['Genre'] if 'Genre' in first_tracks.columns else '',
+            'size': totals['_size'].astype('int64'),
+            'alloc_size': (totals['_alloc_size'] + dir_overhead).astype('int64'),
+            'play_count': totals['_play_count'].astype('int64'),
+            'track_count': grouped.size(),
+        }, index=totals.index, columns=ALBUM_COLUMNS)
+        all_albums.index.name = None
+        track_count = len(tracks_df)
+        
+        # If an album has no size yet, try to get it from the file system
+        no_size = all_albums.index[all_albums['size'] == 0]
+        if len(no_size) > 0:
+            no_size_tracks = tracks_df[tracks_df['_album_path'].isin(no_size)]
+            for album_path, album_track_paths in no_size_tracks.groupby('_album_path', sort=False)['_track_path']:
                 try:
                     total_size = 0
-                    for track_path in tracks:
+                    alloc_size = 0
+                    for track_path in album_track_paths:
                         if os.path.exists(track_path):
-                            total_size += os.path.getsize(track_path)
-                    all_albums[album_path]['size'] = total_size
+                            track_size = os.path.getsize(track_path)
+                            total_size += track_size
+                            alloc_size += round_to_clusters(track_size, cluster_size)
+                    all_albums.at[album_path, 'size'] = total_size
+                    all_albums.at[album_path, 'alloc_size'] = alloc_size + dir_overhead[album_path]
                 except Exception as e:
                     print(f"Error getting size for {album_path}: {e}")
         
+        if metadata_cache is not None:
+            fill_missing_details(all_albums, first_tracks['_track_path'], metadata_cache)
+        
         print(f"Processed {track_count} tracks into {len(all_albums)} albums")
         print(f"Skipped {no_path_count} tracks with no path")
         print(f"Skipped {wrong_path_count} tracks with wrong path format")
+        print(f"Skipped {clutter_count} clutter files that are never copied")
         
         # Debug: Show sample of found albums
         print("Sample of found albums:")
-        for path, album in list(all_albums.items())[:5]:
-            print(f"  - {path} ({album['artist']} - {album['album']}), Size: {album['size']:,} bytes")
+        for album in all_albums.head(5).itertuples(index=False):
+            print(f"  - {album.path} ({album.artist} - {album.album}), Size: {album.size:,} bytes")
     
     except Exception as e:
         print(f"Error processing track file: {e}")
@@ -227,6 +276,81 @@ def get_albums_from_tracks(track_file):
     
     return all_albums
 
+def plan_album_fill(available, remaining_space):
+    """Choose albums that fill the remaining space, treating the fill as a knapsack problem
+    
+    Each album's value combines a base value per album (variety), its play count and
+    how many other candidate albums share its artist. Albums are packed greedily by
+    value per byte, the leftover space is filled with the largest albums that still
+    fit, and finally small chosen albums are swapped for larger ones of at least equal
+    value to use the remaining gap.
+    """
+    start = time.time()
+    
+    sizes = available['alloc_size'].to_numpy(dtype=np.int64)
+    play_counts = available['play_count'].to_numpy(dtype=np.float64)
+    artists = available['artist'].fillna('').astype(str).where(available['artist'].notna(), available['path'])
+    artist_albums = artists.map(artists.value_counts()).to_numpy(dtype=np.float64)
+    
+    values = (ALBUM_WEIGHT
+              + PLAY_COUNT_WEIGHT * np.log1p(play_counts)
+              + VARIETY_WEIGHT / artist_albums)
+    
+    # Pass 1: greedy by value density (value per GB)
+    density = values / (sizes / (1024*1024*1024))
+    order = np.argsort(-density, kind='stable')
+    selected = np.zeros(len(sizes), dtype=bool)
+    used = 0
+    for i in order:
+        if used + sizes[i] <= remaining_space:
+            selected[i] = True
+            used += sizes[i]
+    
+    # Pass 2: fill the leftover with the largest albums that still fit
+    for i in np.argsort(-sizes, kind='stable'):
+        if not selected[i] and used + sizes[i] <= remaining_space:
+            selected[i] = True
+            used += sizes[i]
+    
+    # Pass 3: swap a chosen album for a larger unchosen one of equal or higher value
+    # when the difference fits in the gap
+    chosen = sorted((sizes[i], i) for i in np.flatnonzero(selected))
+    chosen_sizes = [size for size, _ in chosen]
+    swaps = 0
+    for u in np.argsort(-sizes, kind='stable'):
+        gap = remaining_space - used
+        if gap <= 0 or swaps >= MAX_PLANNER_SWAPS:
+            break
+        if selected[u]:
+            continue
+        # Chosen albums with size in [size(u) - gap, size(u)) free enough room for u
+        lo = bisect.bisect_left(chosen_sizes, sizes[u] - gap)
+        hi = bisect.bisect_left(chosen_sizes, sizes[u])
+        for k in range(lo, hi):
+            size, i = chosen[k]
+            if values[u] >= values[i]:
+                selected[i] = False
+                selected[u] = True
+                used += sizes[u] - size
+                del chosen[k], chosen_sizes[k]
+                position = bisect.bisect_left(chosen_sizes, sizes[u])
+                chosen.insert(position, (sizes[u], u))
+                chosen_sizes.insert(position, sizes[u])
+                swaps += 1
+                break
+    
+    # Copy order: best value density first
+    planned = [i for i in order if selected[i]]
+    planned_albums = available.iloc[planned].to_dict('records')
+    
+    elapsed = time.time() - start
+    utilization = used / remaining_space * 100 if remaining_space > 0 else 0
+    print(f"Packing planner chose {len(planned_albums)} of {len(sizes)} candidate albums in {elapsed:.2f}s")
+    print(f"Planned {used / (1024*1024*1024):.2f} GB of {remaining_space / (1024*1024*1024):.2f} GB remaining "
+          f"({utilization:.2f}% utilization, {(remaining_space - used) / (1024*1024*1024):.2f} GB unused, {swaps} swaps)")
+    
+    return planned_albums
+
 def generate_copy_script(albums_to_copy, remaining_space, mount_dir):
     """Generate a script to copy albums to fill remaining space"""
     if not albums_to_copy:
@@ -240,6 +364,9 @@ def generate_copy_script(albums_to_copy, remaining_space, mount_dir):
         return 0, 0
     
     script_path = "fill_remaining_space.sh"
+    album_list_path = "fill_remaining_space.albums"
+    native_copy = file_copier.use_native_copy()
+    batch = []  # (source, target, label) of every album, for the native copier
     
     with open(script_path, 'w') as script:
         script.write("#!/bin/bash\n\n")
@@ -267,13 +394,16 @@ def generate_copy_script(albums_to_copy, remaining_space, mount_dir):
         script.write("TOTAL_ALBUMS=%d\n" % len(albums_to_copy))
         script.write("CURRENT_ALBUM=0\n\n")
         
-        # Add rsync commands
+        # Add copy commands: one rsync per album, or a single in-process copier
+        # run over the album list if selected (one interpreter for all albums)
+        copier_escaped = os.path.abspath(file_copier.__file__).replace("'", "'\\''")
+        rsync_excludes = " ".join(f"--exclude='{pattern}'" for pattern in RSYNC_EXCLUDES)
         total_size = 0
         album_count = 0
         
         for album in albums_to_copy:
-            # Skip if adding this album would exceed space
-            if total_size + album['size'] > remaining_space:
+            # Skip if adding this album would exceed space (allocated size on the card)
+            if total_size + album['alloc_size'] > remaining_space:
                 continue
             
             path = album['path']
@@ -295,22 +425,38 @@ def generate_copy_script(albums_to_copy, remaining_space, mount_dir):
             path_escaped = path.replace("'", "'\\''")
             target_path_escaped = target_path.replace("'", "'\\''")
             
-            # Increment counter and show progress
-            script.write("CURRENT_ALBUM=$((CURRENT_ALBUM + 1))\n")
-            script.write(f"echo \"Copying album $CURRENT_ALBUM of $TOTAL_ALBUMS: {artist.replace('"', '\\"')} - {album_name.replace('"', '\\"')}\"\n")
-            
-            script.write(f"mkdir -p '{os.path.dirname(target_path_escaped)}'\n")
-            script.write(f"rsync -rtv --progress --no-owner --no-group '{path_escaped}/' '{target_path_escaped}/'\n\n")
-            
-            # Add a checkpoint every 20 albums
-            if album_count % 20 == 0 and album_count > 0:
-                script.write(f"echo \"Copied {album_count} albums so far...\"\n\n")
+            if native_copy:
+                label = " ".join(f"{artist} - {album_name}".split())  # No tabs or newlines in the list
+                batch.append((path, target_path, label))
+            else:
+                # Increment counter and show progress
+                label_escaped = f"{artist} - {album_name}".replace('"', '\\"').replace('$', '\\$').replace('`', '\\`')
+                script.write("CURRENT_ALBUM=$((CURRENT_ALBUM + 1))\n")
+                script.write(f"echo \"Copying album $CURRENT_ALBUM of $TOTAL_ALBUMS: {label_escaped}\"\n")
+                
+                script.write(f"mkdir -p '{os.path.dirname(target_path_escaped)}'\n")
+                script.write(f"rsync -rtv --progress --no-owner --no-group {rsync_excludes} '{path_escaped}/' '{target_path_escaped}/'\n\n")
+                
+                # Add a checkpoint every 20 albums
+                if album_count % 20 == 0 and album_count > 0:
+                    script.write(f"echo \"Copied {album_count} albums so far...\"\n\n")
             
-            total_size += album['size']
+            total_size += album['alloc_size']
             album_count += 1
             
             # No album limit - include all albums that fit
         
+        if native_copy:
+            # Album list read by file_copier.py --batch (tab-separated source, target, label)
+            with open(album_list_path, 'w', encoding='utf-8') as album_list:
+                for source, target, label in batch:
+                    album_list.write(f"{source}\t{target}\t{label}\n")
+            list_escaped = os.path.abspath(album_list_path).replace("'", "'\\''")
+            script.write(f"if ! python3 '{copier_escaped}' --batch '{list_escaped}'; then\n")
+            script.write("  echo \"Some albums failed to copy; run this script again to retry them\"\n")
+            script.write("  exit 1\n")
+            script.write("fi\n\n")
+        
         # Add summary
         script.write(f"echo \"Copied {album_count} albums using approximately {total_size / (1024*1024*1024):.2f} GB\"\n")
         script.write("echo \"Space filling complete!\"\n")
@@ -338,10 +484,12 @@ def main():
         print(f"Error: Mount directory {mount_dir} does not exist")
         sys.exit(1)
     
-    # Step 1: Get current SDXC usage
+    # Step 1: Get current SDXC usage and the card's real free space
     current_usage = get_sdxc_usage(mount_dir)
-    remaining_space = MAX_SIZE - current_usage
+    capacity = get_card_capacity(mount_dir)
+    remaining_space = capacity['usable_bytes']
     print(f"Current SDXC usage: {current_usage / (1024*1024*1024):.2f} GB")
+    print_capacity(capacity)
     print(f"Remaining space: {remaining_space / (1024*1024*1024):.2f} GB")
     
     if remaining_space <= 0:
@@ -351,18 +499,21 @@ def main():
     # Step 2: Get already copied albums
     copied_albums = get_copied_albums(mount_dir)
     
-    # Step 3: Get all albums from track data
-    all_albums = get_albums_from_tracks(track_file)
+    # Step 3: Get all albums from track data, sized in whole clusters of this card
+    if FILL_FROM_TAGS:
+        metadata_cache = MetadataCache()
+        all_albums = get_albums_from_tracks(track_file, capacity['cluster_size'], metadata_cache)
+        metadata_cache.print_stats()
+        metadata_cache.close()
+    else:
+        all_albums = get_albums_from_tracks(track_file, capacity['cluster_size'])
     
     # Step 4: Filter out already copied albums
-    available_albums = []
-    for path, album in all_albums.items():
-        if path not in copied_albums and album['size'] > 0:
-            available_albums.append(album)
+    available = all_albums[~all_albums['path'].isin(copied_albums) & (all_albums['size'] > 0)]
     
-    print(f"Found {len(available_albums)} albums available to copy")
+    print(f"Found {len(available)} albums available to copy")
     
-    if not available_albums:
+    if available.empty:
         print("No albums available to copy! Debugging info:")
         print(f"Total albums in library: {len(all_albums)}")
         print(f"Already copied albums: {len(copied_albums)}")
@@ -372,8 +523,8 @@ def main():
         print("3. No valid size information for albums")
         
         # Check for path format mismatches
-        if all_albums and copied_albums:
-            lib_sample = next(iter(all_albums.keys()))
+        if not all_albums.empty and copied_albums:
+            lib_sample = all_albums['path'].iloc[0]
             copy_sample = next(iter(copied_albums))
             print(f"Library path format: '{lib_sample}'")
             print(f"Copied path format: '{copy_sample}'")
@@ -381,18 +532,8 @@ def main():
         generate_copy_script([], remaining_space, mount_dir)
         sys.exit(0)
     
-    # Step 5: Sort albums by criteria (size and play count)
-    # First prioritize smaller albums to maximize variety
-    available_albums.sort(key=lambda x: x['size'])
-    
-    # Take 75% smaller albums, 25% based on play count
-    split_point = int(len(available_albums) * 0.75)
-    smaller_albums = available_albums[:split_point]
-    popular_albums = sorted(available_albums[split_point:], key=lambda x: x['play_count'], reverse=True)
-    
-    # Combine and shuffle within groups for variety
-    random.shuffle(smaller_albums)
-    prioritized_albums = smaller_albums + popular_albums
+    # Step 5: Plan which albums to copy (value: variety, play count, size preference)
+    prioritized_albums = plan_album_fill(available, remaining_space)
     
     # Step 6: Generate copy script
     album_count, total_size = generate_copy_script(prioritized_albums, remaining_space, mount_dir)
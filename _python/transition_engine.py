@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+Track Transition Engine
+-----------------------
+Orders the tracks of a DJ-flow playlist so that neighbouring tracks sound
+alike while the energy follows the intro/buildup/peak/outro curve.
+
+1. Every track gets a feature vector from its tags and cached analysis:
+   genre, year, duration, sample rate, play count and, where measured
+   (see audio_analysis.py), loudness and tempo. Numeric features are
+   standardized; missing values take the median of the known ones.
+2. The candidate pool of a playlist is its most played eligible tracks plus
+   their k nearest neighbours among the eligible tracks. The neighbours are
+   found with NumPy in blocks of query rows, so memory stays bounded on
+   100k-track cards and no all-pairs matrix is ever built.
+3. The chosen tracks (a playlist holds a few dozen) are ordered by a greedy
+   walk that, at each position, picks the closest unvisited track whose
+   energy is near the target of the curve, and then improved with 2-opt
+   segment reversals.
+
+Used by playlist-generator.py.
+"""
+
+import numpy as np
+
+# Configuration
+KNN_NEIGHBORS = 10
+DISTANCE_BLOCK_ELEMENTS = 4_000_000  # Distance matrix elements computed at a time
+TWO_OPT_PASSES = 4
+GENRE_FEATURE_LIMIT = 24  # One-hot columns for the most common genres
+ENERGY_WEIGHT = 2.0  # Weight of the energy difference in a transition
+CURVE_WEIGHT = 3.0  # Cost per unit of distance from the target energy
+
+# Relative weight of each feature in the distance between two tracks
+FEATURE_WEIGHTS = {
+    'genre': 1.0,
+    'year': 1.0,
+    'duration': 0.5,
+    'sample_rate': 0.5,
+    'play_count': 0.5,
+    'loudness': 1.0,
+    'tempo': 1.0,
+}
+
+# Target energy along the playlist (position 0-1, energy), matching the
+# intro (15%), buildup (30%), peak (30%) and outro sections
+FLOW_CURVE = [(0.0, 0.3), (0.15, 0.5), (0.45, 0.8), (0.5, 0.9), (0.75, 0.9), (0.78, 0.5), (1.0, 0.2)]
+
+def _standardize(values, known):
+    """Fill unknown values with the median of the known ones and scale to unit variance"""
+    values = values.astype(np.float64)
+    if not known.any():
+        return None
+    values = np.where(known, values, np.median(values[known]))
+    std = values.std()
+    return (values - values.mean()) / (std if std > 0 else 1.0)
+
+def build_features(store):
+    """Return an N x D float32 feature matrix for every track in the store"""
+    columns = []
+
+    # Genre: one-hot over the most common genres, scaled so two different
+    # genres are FEATURE_WEIGHTS['genre'] apart
+    genre_codes = store['genre']
+    if len(genre_codes):
+        common = np.argsort(-np.bincount(genre_codes), kind='stable')[:GENRE_FEATURE_LIMIT]
+        one_hot = (genre_codes[:, None] == common[None, :]).astype(np.float32)
+        columns.append(one_hot * (FEATURE_WEIGHTS['genre'] / np.sqrt(2)))
+
+    year = store['year']
+    duration = store['duration']
+    sample_rate = store['sample_rate']
+    loudness = store['loudness']
+    tempo = store['tempo']
+    numeric = {
+        'year': _standardize(year, year > 0),
+        'duration': _standardize(np.log1p(duration), duration > 0),
+        'sample_rate': _standardize(np.log2(np.maximum(sample_rate, 1)), sample_rate > 0),
+        'play_count': _standardize(np.log1p(np.maximum(store['play_count'], 0)), np.ones(len(store), dtype=bool)),
+        'loudness': _standardize(loudness, ~np.isnan(loudness)),
+        'tempo': _standardize(np.log2(np.nan_to_num(tempo, nan=1.0).clip(1)), tempo > 0),
+    }
+    for name, values in numeric.items():
+        if values is not None:
+            columns.append((values * FEATURE_WEIGHTS[name])[:, None].astype(np.float32))
+
+    if not columns:
+        return np.zeros((len(store), 0), dtype=np.float32)
+    return np.hstack(columns)
+
+def knn_graph(features, k=KNN_NEIGHBORS, rows=None):
+    """Return (neighbours, distances): the k nearest other rows of each of rows
+    (default: every row), nearest first
+
+    Distances are computed for a block of query rows against all rows at a
+    time, so memory use is bounded by DISTANCE_BLOCK_ELEMENTS instead of N x N.
+    """
+    count = len(features)
+    rows = np.arange(count) if rows is None else np.asarray(rows)
+    k = min(k, count - 1)
+    if k <= 0:
+        return np.zeros((len(rows), 0), dtype=np.int32), np.zeros((len(rows), 0), dtype=np.float32)
+
+    features = features.astype(np.float32)
+    sq_norms = np.einsum('ij,ij->i', features, features)
+    neighbours = np.empty((len(rows), k), dtype=np.int32)
+    distances = np.empty((len(rows), k), dtype=np.float32)
+    block = max(1, DISTANCE_BLOCK_ELEMENTS // count)
+
+    for start in range(0, len(rows), block):
+        end = min(len(rows), start + block)
+        query = rows[start:end]
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b
+        d2 = sq_norms[query, None] + sq_norms[None, :] - 2 * (features[query] @ features.T)
+        d2[np.arange(end - start), query] = np.inf  # Not its own neighbour
+        nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        nearest_d2 = np.take_along_axis(d2, nearest, axis=1)
+        order = np.argsort(nearest_d2, axis=1, kind='stable')
+        neighbours[start:end] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:end] = np.sqrt(np.maximum(np.take_along_axis(nearest_d2, order, axis=1), 0))
+
+    return neighbours, distances
+
+def _first_occurrences(rows):
+    """Return rows with repeats removed, keeping the first occurrence of each"""
+    _, first = np.unique(rows, return_index=True)
+    return rows[np.sort(first)]
+
+def candidate_pool(ranked, features, seed_count, limit):
+    """Return up to limit rows: the first seed_count of ranked, then their
+    nearest neighbours among ranked (nearest first), then the rest of ranked
+
+    ranked holds the eligible rows in order of preference; features is the
+    feature matrix of every track. Only the seeds are queried, so the cost
+    grows with the number of eligible rows, not with its square.
+    """
+    seeds = ranked[:seed_count]
+    neighbours, _ = knn_graph(features[ranked], rows=np.arange(len(seeds)))
+    # Column-major, so every seed's nearest neighbour comes before any second nearest
+    near = neighbours.T.ravel()
+    near = near[near >= len(seeds)]
+    pool = np.concatenate([seeds, ranked[near], ranked[seed_count:]])
+    return _first_occurrences(pool)[:limit]
+
+def flow_targets(count):
+    """Return the target energy of each of count playlist positions"""
+    if count <= 0:
+        return np.zeros(0)
+    positions = np.linspace(0, 1, count) if count > 1 else np.zeros(1)
+    xs, ys = zip(*FLOW_CURVE)
+    return np.interp(positions, xs, ys)
+
+def _with_energy(features, energy):
+    """Append the weighted energy to the feature vectors"""
+    return np.hstack([features, (ENERGY_WEIGHT * energy)[:, None]]).astype(np.float32)
+
+def order_tracks(features, energy, targets=None):
+    """Return an ordering (positions into features) that follows the energy targets smoothly
+
+    features holds one row per chosen track; energy is their energy (0-1).
+    The ordering is a greedy walk over the pairwise distances of the chosen
+    tracks, improved by 2-opt segment reversals.
+    """
+    count = len(features)
+    if count <= 1:
+        return list(range(count))
+    if targets is None:
+        targets = flow_targets(count)
+
+    points = _with_energy(features, energy)
+
+    # The playlist itself is small, so its pairwise distances are cheap to keep
+    sq_norms = np.einsum('ij,ij->i', points, points)
+    dist = np.sqrt(np.maximum(sq_norms[:, None] + sq_norms[None, :] - 2 * (points @ points.T), 0))
+
+    # Greedy walk: start nearest the first target, then take the unvisited
+    # track with the lowest transition plus curve cost
+    visited = np.zeros(count, dtype=bool)
+    current = int(np.argmin(np.abs(energy - targets[0])))
+    order = [current]
+    visited[current] = True
+    for position in range(1, count):
+        candidates = np.flatnonzero(~visited)
+        cost = dist[current, candidates] + CURVE_WEIGHT * np.abs(energy[candidates] - targets[position])
+        current = int(candidates[np.argmin(cost)])
+        order.append(current)
+        visited[current] = True
+    order = np.array(order)
+
+    # 2-opt: reverse a segment when that lowers the transition plus curve cost.
+    # Only the two edges at the segment ends and the segment's curve cost change.
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        for i in range(count - 1):
+            for j in range(i + 1, count):
+                segment = order[i:j + 1]
+                segment_targets = targets[i:j + 1]
+                delta = CURVE_WEIGHT * (np.abs(energy[segment[::-1]] - segment_targets).sum()
+                                        - np.abs(energy[segment] - segment_targets).sum())
+                if i > 0:
+                    delta += dist[order[i - 1], order[j]] - dist[order[i - 1], order[i]]
+                if j < count - 1:
+                    delta += dist[order[i], order[j + 1]] - dist[order[j], order[j + 1]]
+                if delta < -1e-9:
+                    order[i:j + 1] = segment[::-1].copy()
+                    improved = True
+        if not improved:
+            break
+
+    return order.tolist()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+"""
+User Paths
+----------
+Host-side directories of the user running the toolkit. The snapshot, rebuild
+and declutter stages run through sudo, where ~ is root's home; like the shell
+wrappers, these paths resolve to the home of the user who invoked sudo, so
+every stage shares the same cache.
+"""
+
+import os
+
+def user_home():
+    """Return the home directory of the invoking user, also when run through sudo"""
+    sudo_user = os.environ.get('SUDO_USER')
+    return os.path.expanduser(f"~{sudo_user}" if sudo_user else "~")
+
+# Configuration
+CACHE_DIR = os.path.join(user_home(), "SP3000Util", "cache")
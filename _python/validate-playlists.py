@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Playlist Validator for A&K SP3000
+---------------------------------
+Checks that every track referenced by the M3U files in Music/Playlists exists
+on the SDXC card. Both path styles written by this toolkit are resolved:
+- absolute /MUSIC_SDXC/CD/... and /MUSIC_SDXC/Hires/... paths (process-playlists.py)
+- ../CD/... and ../Hires/... paths relative to the playlist (playlist-generator.py)
+
+All entries are looked up in one in-memory set of card paths built from the
+card inventory (see card_inventory.py), so no entry is stat'ed on the card.
+
+Broken entries are reported per playlist. With --copy, the albums they belong
+to are copied from the NAS through the shared copy engine.
+
+Usage: python validate-playlists.py <mount_directory> [--copy]
+"""
+
+import os
+import sys
+import time
+
+from card_inventory import get_dir_files, iter_dirs, load_card_inventory
+from copy_engine import CopyEngine, find_pending_files
+
+# Configuration
+NAS_ROOT_CD = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
+NAS_ROOT_HIRES = "/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
+CARD_LABEL_PREFIX = "/MUSIC_SDXC/"  # Absolute playlist paths start at the card's volume label
+PLAYLIST_DIR = os.path.join("Music", "Playlists")
+MAX_REPORTED_PER_PLAYLIST = 10  # Broken entries printed per playlist
+
+def build_card_path_set(inventory):
+    """Return the set of every file on the card under Music, as paths relative to the mount"""
+    mount_dir = inventory['mount_dir']
+    card_paths = set()
+    for dir_path, files in iter_dirs(inventory, "Music"):
+        rel_dir = os.path.relpath(dir_path, mount_dir)
+        card_paths.update(f"{rel_dir}/{name}" for name in files)
+    return card_paths
+
+def resolve_entry(entry):
+    """Return the card path (relative to the mount) an M3U entry points at, or None if it is not on the card"""
+    if entry.startswith(CARD_LABEL_PREFIX):
+        return "Music/" + entry[len(CARD_LABEL_PREFIX):]
+    if os.path.isabs(entry):
+        return None
+    return os.path.normpath(os.path.join(PLAYLIST_DIR, entry))
+
+def read_m3u_entries(m3u_path):
+    """Return the track entries of an M3U file (comments and blank lines skipped)"""
+    with open(m3u_path, encoding='utf-8', errors='replace') as m3u:
+        return [line.strip() for line in m3u if line.strip() and not line.startswith('#')]
+
+def find_broken_entries(mount_dir, inventory):
+    """Return ({playlist name: [(entry, card path or None)]}, total entries) for entries missing on the card"""
+    card_paths = build_card_path_set(inventory)
+    print(f"Indexed {len(card_paths)} files on the card")
+
+    broken = {}
+    total = 0
+    for name in sorted(get_dir_files(inventory, PLAYLIST_DIR)):
+        if not name.lower().endswith('.m3u'):
+            continue
+        entries = read_m3u_entries(os.path.join(mount_dir, PLAYLIST_DIR, name))
+        total += len(entries)
+        missing = []
+        for entry in entries:
+            card_path = resolve_entry(entry)
+            if card_path not in card_paths:
+                missing.append((entry, card_path))
+        if missing:
+            broken[name] = missing
+    return broken, total
+
+def nas_album_dir(card_album_dir):
+    """Map a card album directory (Music/CD/... or Music/Hires/...) to its NAS source, or None"""
+    for card_root, nas_root in ((os.path.join("Music", "CD"), NAS_ROOT_CD),
+                                (os.path.join("Music", "Hires"), NAS_ROOT_HIRES)):
+        if card_album_dir.startswith(card_root + os.sep):
+            return os.path.join(nas_root, card_album_dir[len(card_root) + 1:])
+    return None
+
+def copy_missing_albums(broken, mount_dir, inventory):
+    """Copy the albums of broken entries from the NAS
+    
+    Returns the number of albums that are still incomplete: not found on the
+    NAS, without the missing tracks, or failed to copy.
+    """
+    albums = {}
+    for missing in broken.values():
+        for entry, card_path in missing:
+            if card_path is not None:
+                card_album_dir = os.path.dirname(card_path)
+                albums.setdefault(card_album_dir, nas_album_dir(card_album_dir))
+
+    print(f"\nScheduling {len(albums)} albums for copy...")
+    copy_engine = CopyEngine()
+    queued = 0
+    unresolved = 0
+    try:
+        for card_album_dir, album_path in albums.items():
+            if album_path is None or not os.path.isdir(album_path):
+                print(f"  Warning: Album not found on NAS: {album_path or card_album_dir}")
+                unresolved += 1
+                continue
+            sdxc_album_path = os.path.join(mount_dir, card_album_dir)
+            pending = find_pending_files(album_path, sdxc_album_path, inventory, mount_dir)
+            if pending:
+                copy_engine.submit(album_path, sdxc_album_path, pending=pending)
+                queued += 1
+            else:
+                # The card already has every file of the NAS album
+                print(f"  Warning: Missing tracks not found in NAS album: {album_path}")
+                unresolved += 1
+        if queued:
+            _, failed, _ = copy_engine.wait()
+            unresolved += failed
+    finally:
+        copy_engine.shutdown()
+    return unresolved
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python validate-playlists.py <mount_directory> [--copy]")
+        sys.exit(1)
+
+    mount_dir = sys.argv[1]
+    copy_missing = '--copy' in sys.argv[2:]
+    if not os.path.isdir(mount_dir):
+        print(f"Error: Mount directory {mount_dir} does not exist")
+        sys.exit(1)
+
+    start = time.time()
+    inventory = load_card_inventory(mount_dir)
+    broken, total = find_broken_entries(mount_dir, inventory)
+
+    broken_count = sum(len(missing) for missing in broken.values())
+    for name, missing in broken.items():
+        print(f"\n{name}: {len(missing)} broken entries")
+        for entry, card_path in missing[:MAX_REPORTED_PER_PLAYLIST]:
+            print(f"  - {entry}" if card_path else f"  - {entry} (not a path on the card)")
+        if len(missing) > MAX_REPORTED_PER_PLAYLIST:
+            print(f"  ... and {len(missing) - MAX_REPORTED_PER_PLAYLIST} more")
+
+    print(f"\nChecked {total} entries in {time.time() - start:.1f}s: {broken_count} broken "
+          f"in {len(broken)} playlists")
+
+    if broken and copy_missing:
+        unresolved = copy_missing_albums(broken, mount_dir, inventory)
+        off_card = sum(1 for missing in broken.values() for _, card_path in missing if card_path is None)
+        if unresolved or off_card:
+            print(f"\nStill unresolved: {unresolved} albums could not be copied, "
+                  f"{off_card} entries do not point at the card")
+            sys.exit(1)
+    elif broken:
+        print("Run with --copy to copy the missing albums from the NAS")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,9 @@
 # Wrapper script to create playlists on the SDXC card
 # Calls playlist-generator.py in the _python directory
 
-# Usage: ./create-playlists.sh [device]
+# Usage: ./create-playlists.sh [device] [analyze]
 # Example: ./create-playlists.sh /dev/sdc1
+#          ./create-playlists.sh /dev/sdc1 analyze  (measure energy, loudness and tempo first)
 
 # Configuration
 PYTHON_DIR="./_python"
@@ -16,12 +17,19 @@ MOUNT_DIR="$HOME/SP3000Util/mnt"
 echo "=== A&K SP3000 Playlist Creation Utility ==="
 echo "This script will create DJ-like flow-optimized playlists on your SDXC card"
 
+# Optional last argument: analyse new tracks before creating playlists
+ANALYZE_MODE=0
+if [ $# -gt 0 ] && [ "${!#}" = "analyze" ]; then
+  ANALYZE_MODE=1
+  set -- "${@:1:$(($# - 1))}"
+fi
+
 # Check for device parameter
 if [ $# -eq 0 ]; then
   # No device parameter provided
   if ! mountpoint -q "$MOUNT_DIR"; then
     echo "Error: No device specified and no SD card mounted at $MOUNT_DIR"
-    echo "Usage: $0 [device]"
+    echo "Usage: $0 [device] [analyze]"
     echo "Example: $0 /dev/sdc1"
     exit 1
   fi
@@ -96,6 +104,14 @@ fi
 # Make sure Python script is executable
 chmod +x "$PYTHON_DIR/playlist-generator.py"
 
+# Measure tracks that have not been analysed yet (requires ffmpeg)
+if [ "$ANALYZE_MODE" -eq 1 ]; then
+    echo "Running audio_analysis.py to measure new tracks..."
+    if ! python3 "$PYTHON_DIR/audio_analysis.py" "$MOUNT_DIR"; then
+        echo "Warning: Audio analysis failed; playlists will use estimated energy where tracks are not measured"
+    fi
+fi
+
 # Run the Python script
 echo "Running playlist-generator.py to create playlists..."
 python3 "$PYTHON_DIR/playlist-generator.py" "$TRACKS_FILE" "$MOUNT_DIR"
@@ -2,9 +2,10 @@
 #
 # rebuild-sdxc.sh
 # Purpose: Rebuild an SDXC card from a snapshot file
-# Usage: ./rebuild-sdxc.sh <device_partition> <snapshot_file> [resume]
+# Usage: ./rebuild-sdxc.sh <device_partition> <snapshot_file> [resume|sync]
 # Example: ./rebuild-sdxc.sh /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt
 # Example with resume: ./rebuild-sdxc.sh /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt resume
+# Example with sync: ./rebuild-sdxc.sh /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt sync
 #
 # This script:
 # - Mounts the SD card if not already mounted
@@ -12,6 +13,9 @@
 # - Optionally erases the card (if not in resume mode)
 # - Copies the specified albums from server to SD card
 # - Uses rsync for efficient copying and resuming
+# - Records finished albums in a journal so resume skips them
+# - In sync mode, copies or deletes only the files that differ from the
+#   snapshot and the NAS
 #
 
 # Define paths
@@ -26,29 +30,37 @@ fi
 
 MOUNT_POINT="$REAL_HOME/SP3000Util/mnt"
 MUSIC_DIR="$MOUNT_POINT/Music"
+PYTHON_DIR="./_python"
+CACHE_DIR="$REAL_HOME/SP3000Util/cache"  # Card inventory and rebuild journals
 
-# Create mount point with proper ownership if running as sudo
+# Create mount point and cache with proper ownership if running as sudo
 if [ -n "$SUDO_USER" ]; then
-    mkdir -p "$MOUNT_POINT"
-    chown -R "$REAL_USER":"$REAL_USER" "$MOUNT_POINT"
+    mkdir -p "$MOUNT_POINT" "$CACHE_DIR"
+    chown -R "$REAL_USER":"$REAL_USER" "$MOUNT_POINT" "$CACHE_DIR"
 fi
 
 # Check if required parameters were provided
 if [ $# -lt 2 ]; then
-    echo "Usage: $0 <device_partition> <snapshot_file> [resume]"
+    echo "Usage: $0 <device_partition> <snapshot_file> [resume|sync]"
     echo "Example: $0 /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt"
     echo "Example with resume: $0 /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt resume"
+    echo "Example with sync: $0 /dev/sdc1 ~/SP3000Util/snapshots/sd_snap_20250422_120000.txt sync"
     exit 1
 fi
 
 DEVICE="$1"
 SNAPSHOT_FILE="$2"
 RESUME_MODE=0
+SYNC_MODE=0
 
-# Check if resume parameter was provided
+# Check if resume or sync parameter was provided
 if [ $# -eq 3 ] && [ "$3" = "resume" ]; then
     RESUME_MODE=1
     echo "Running in resume mode. Will not erase card."
+elif [ $# -eq 3 ] && [ "$3" = "sync" ]; then
+    RESUME_MODE=1
+    SYNC_MODE=1
+    echo "Running in sync mode. Will only copy or delete changed files."
 fi
 
 # Check if the device exists
@@ -151,58 +163,20 @@ validate_snapshot() {
 copy_albums() {
     echo "Starting album copy process..."
     
-    total_count=0
-    success_count=0
-    
-    # Process each line in the snapshot file
-    while IFS= read -r line; do
-        # Skip comments and empty lines
-        if [[ "$line" =~ ^#.*$ ]] || [[ -z "$line" ]]; then
-            continue
-        fi
-        
-        # Extract type and path
-        type=$(echo "$line" | cut -d'|' -f1)
-        path=$(echo "$line" | cut -d'|' -f2)
-        album_name=$(basename "$path")
-        
-        # Increment total count
-        ((total_count++))
-        
-        # Skip if path doesn't exist
-        if [ ! -d "$path" ]; then
-            echo "Warning: Source path does not exist: $path"
-            continue
-        fi
-        
-        # Determine destination directory
-        if [ "$type" = "CD" ]; then
-            dest_dir="$MUSIC_DIR/CD/$album_name"
-        elif [ "$type" = "HIRES" ]; then
-            dest_dir="$MUSIC_DIR/Hires/$album_name"
-        else
-            echo "Warning: Unknown type '$type' for path: $path"
-            continue
-        fi
-        
-        # Create destination directory if it doesn't exist
-        mkdir -p "$dest_dir"
-        
-        # Copy files using rsync
-        echo "Copying $type album: $album_name"
-        if rsync -av --progress "$path/" "$dest_dir/" --exclude ".*" --exclude "*.jpg" --exclude "*.png" --exclude "*.txt" --exclude "*.log" --exclude "*.url" --exclude "Artwork/" --exclude "artwork/"; then
-            ((success_count++))
-            echo "Successfully copied $album_name"
-        else
-            echo "Error copying $album_name"
-        fi
-        
-        # Add a blank line for separation
-        echo ""
-    done < "$SNAPSHOT_FILE"
-    
-    echo "Copy process complete."
-    echo "Successfully copied $success_count of $total_count albums."
+    # The Python rebuild engine copies albums in parallel and journals each
+    # finished album, so a resumed rebuild skips them without rescanning
+    local status
+    if [ $SYNC_MODE -eq 1 ]; then
+        python3 "$PYTHON_DIR/rebuild-sdxc.py" "$SNAPSHOT_FILE" "$MOUNT_POINT" sync
+        status=$?
+    elif [ $RESUME_MODE -eq 1 ]; then
+        python3 "$PYTHON_DIR/rebuild-sdxc.py" "$SNAPSHOT_FILE" "$MOUNT_POINT" resume
+        status=$?
+    else
+        python3 "$PYTHON_DIR/rebuild-sdxc.py" "$SNAPSHOT_FILE" "$MOUNT_POINT"
+        status=$?
+    fi
+    return $status
 }
 
 # Main execution
@@ -218,7 +192,20 @@ validate_snapshot
 prepare_card
 
 # Step 4: Copy albums
-copy_albums
+if ! copy_albums; then
+    echo ""
+    echo "Error: Rebuild did not complete; some albums are missing or failed to copy"
+    echo "Check the output above, then continue where it stopped with:"
+    if [ $SYNC_MODE -eq 1 ]; then
+        echo "$0 $DEVICE $SNAPSHOT_FILE sync"
+    else
+        echo "$0 $DEVICE $SNAPSHOT_FILE resume"
+    fi
+    echo ""
+    echo "To unmount the card:"
+    echo "sudo umount $MOUNT_POINT"
+    exit 1
+fi
 
 echo "Rebuild process complete!"
 echo ""
@@ -2,19 +2,18 @@
 #
 # snapshot-card.sh
 # Purpose: Create a snapshot file of all album paths on an SDXC card
-# Usage: ./snapshot-card.sh <device_partition>
+# Usage: ./snapshot-card.sh <device_partition> [checksum]
 # Example: ./snapshot-card.sh /dev/sdc1
+# Example with checksums: ./snapshot-card.sh /dev/sdc1 checksum
 #
 # This script:
 # - Mounts the SD card if not already mounted
 # - Scans the current card to identify which albums are present
-# - Creates a snapshot file with NAS paths for all albums
+# - Creates a snapshot file with NAS paths for all albums, and the size,
+#   mtime and (optionally) CRC32 of every file in them
 #
 
 # Define paths
-SERVER_CD_PATH="/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 16-Bit CD"
-SERVER_HIRES_PATH="/home/music/drobos/hibiki/Media/Music/Lossless/FLAC 24-Bit HiRes"
-
 # Handle sudo correctly by getting the real user's home directory
 if [ -n "$SUDO_USER" ]; then
     REAL_USER="$SUDO_USER"
@@ -24,24 +23,34 @@ else
     REAL_HOME="$HOME"
 fi
 
+PYTHON_DIR="./_python"
 MOUNT_POINT="$REAL_HOME/SP3000Util/mnt"
 MUSIC_DIR="$MOUNT_POINT/Music"
 SNAPSHOTS_DIR="$REAL_HOME/SP3000Util/snapshots"
+CACHE_DIR="$REAL_HOME/SP3000Util/cache"  # Card inventory, shared with the other stages
 
 # Create directories with proper ownership if running as sudo
 if [ -n "$SUDO_USER" ]; then
-    mkdir -p "$MOUNT_POINT" "$SNAPSHOTS_DIR"
-    chown -R "$REAL_USER":"$REAL_USER" "$MOUNT_POINT" "$SNAPSHOTS_DIR"
+    mkdir -p "$MOUNT_POINT" "$SNAPSHOTS_DIR" "$CACHE_DIR"
+    chown -R "$REAL_USER":"$REAL_USER" "$MOUNT_POINT" "$SNAPSHOTS_DIR" "$CACHE_DIR"
 fi
 
 # Check if device parameter was provided
-if [ $# -ne 1 ]; then
-    echo "Usage: $0 <device_partition>"
+if [ $# -lt 1 ] || [ $# -gt 2 ]; then
+    echo "Usage: $0 <device_partition> [checksum]"
     echo "Example: $0 /dev/sdc1"
+    echo "Example with checksums: $0 /dev/sdc1 checksum"
     exit 1
 fi
 
 DEVICE="$1"
+CHECKSUM_ARG=""
+
+# Check if checksum parameter was provided (reads every file on the card)
+if [ $# -eq 2 ] && [ "$2" = "checksum" ]; then
+    CHECKSUM_ARG="checksum"
+    echo "Recording CRC32 checksums of all files."
+fi
 
 # Check if the device exists
 if [ ! -b "$DEVICE" ]; then
@@ -115,39 +124,12 @@ create_snapshot() {
         exit 1
     fi
     
-    # Initialize the snapshot file with header
-    echo "# SDXC Card Snapshot created $(date)" > "$SNAPSHOT_FILE"
-    echo "# Device: $DEVICE" >> "$SNAPSHOT_FILE"
-    echo "# " >> "$SNAPSHOT_FILE"
-    echo "# Format: <type>|<NAS path>" >> "$SNAPSHOT_FILE"
-    echo "# " >> "$SNAPSHOT_FILE"
-    
-    # Find and add CD albums to snapshot
-    echo "Finding CD-quality albums..."
-    cd_count=0
-    
-    while IFS= read -r album_path; do
-        album_name=$(basename "$album_path")
-        echo "CD|$SERVER_CD_PATH/$album_name" >> "$SNAPSHOT_FILE"
-        ((cd_count++))
-    done < <(find "$MUSIC_DIR/CD" -mindepth 1 -maxdepth 1 -type d | sort)
-    
-    # Find and add HiRes albums to snapshot
-    echo "Finding HiRes albums..."
-    hires_count=0
-    
-    while IFS= read -r album_path; do
-        album_name=$(basename "$album_path")
-        echo "HIRES|$SERVER_HIRES_PATH/$album_name" >> "$SNAPSHOT_FILE"
-        ((hires_count++))
-    done < <(find "$MUSIC_DIR/Hires" -mindepth 1 -maxdepth 1 -type d | sort)
-    
-    # Add summary to snapshot
-    echo "# " >> "$SNAPSHOT_FILE"
-    echo "# Summary: $cd_count CD albums, $hires_count HiRes albums" >> "$SNAPSHOT_FILE"
-    echo "# Total: $((cd_count + hires_count)) albums" >> "$SNAPSHOT_FILE"
+    # Write the snapshot from the shared card inventory
+    if ! python3 "$PYTHON_DIR/card_snapshot.py" "$MOUNT_POINT" "$SNAPSHOT_FILE" "$DEVICE" $CHECKSUM_ARG; then
+        echo "Error: Failed to create snapshot"
+        exit 1
+    fi
     
-    echo "Snapshot created with $cd_count CD albums and $hires_count HiRes albums"
     echo "Snapshot file: $SNAPSHOT_FILE"
 }
 
@@ -168,6 +150,6 @@ echo "To unmount the card:"
 echo "sudo umount $MOUNT_POINT"
 echo ""
 echo "To rebuild a card using this snapshot:"
-echo "./rebuild-sdxc.sh <device> $SNAPSHOT_FILE [resume]"
+echo "./rebuild-sdxc.sh <device> $SNAPSHOT_FILE [resume|sync]"
 
 exit 0
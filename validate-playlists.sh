@@ -0,0 +1,90 @@
+#!/bin/bash
+
+# validate-playlists.sh
+# Checks that every track in the M3U playlists on the SDXC card exists
+# Calls validate-playlists.py in the _python directory
+
+# Usage: ./validate-playlists.sh [device] [copy]
+# Example: ./validate-playlists.sh /dev/sdc1
+#          ./validate-playlists.sh /dev/sdc1 copy  (copy the missing albums from the NAS)
+
+# Configuration
+PYTHON_DIR="./_python"
+PYTHON_SCRIPT="$PYTHON_DIR/validate-playlists.py"
+MOUNT_DIR="$HOME/SP3000Util/mnt"
+
+echo "=== A&K SP3000 Playlist Validator ==="
+echo "This script will check the tracks referenced by the playlists on your SDXC card"
+
+# Optional last argument: copy the albums of broken entries
+VALIDATE_ARGS=()
+if [ $# -gt 0 ] && [ "${!#}" = "copy" ]; then
+  VALIDATE_ARGS+=("--copy")
+  set -- "${@:1:$(($# - 1))}"
+fi
+
+# Check for device parameter
+if [ $# -eq 0 ]; then
+  # No device parameter provided
+  if ! mountpoint -q "$MOUNT_DIR"; then
+    echo "Error: No device specified and no SD card mounted at $MOUNT_DIR"
+    echo "Usage: $0 [device] [copy]"
+    echo "Example: $0 /dev/sdc1"
+    exit 1
+  fi
+  echo "Using already mounted SD card at $MOUNT_DIR"
+else
+  DEVICE="$1"
+
+  # Check if the device exists
+  if [ ! -b "$DEVICE" ]; then
+    echo "Error: Device $DEVICE does not exist or is not a block device"
+    exit 1
+  fi
+
+  # Check if the device is already mounted
+  MOUNT_POINT=$(findmnt -n -o TARGET "$DEVICE" 2>/dev/null)
+  if [ -n "$MOUNT_POINT" ]; then
+    if [ "$MOUNT_POINT" != "$MOUNT_DIR" ]; then
+      echo "Device $DEVICE is already mounted at $MOUNT_POINT"
+      echo "Please unmount it first or use the already mounted path"
+      exit 1
+    else
+      echo "Device $DEVICE is already mounted at $MOUNT_DIR"
+    fi
+  else
+    # Create mount directory if it doesn't exist
+    mkdir -p "$MOUNT_DIR"
+
+    # Mount the device
+    echo "Mounting $DEVICE to $MOUNT_DIR..."
+    if ! mount "$DEVICE" "$MOUNT_DIR"; then
+      echo "Error: Failed to mount $DEVICE to $MOUNT_DIR"
+      echo "You might need to configure /etc/fstab or use udisksctl to allow mounting without sudo"
+      exit 1
+    fi
+    echo "Device $DEVICE mounted successfully to $MOUNT_DIR"
+  fi
+fi
+
+# Check if Python script exists
+if [ ! -f "$PYTHON_SCRIPT" ]; then
+    echo "Error: Python script not found at $PYTHON_SCRIPT"
+    exit 1
+fi
+
+# Check if there is a playlist directory to validate
+if [ ! -d "$MOUNT_DIR/Music/Playlists" ]; then
+    echo "Error: No playlist directory found at $MOUNT_DIR/Music/Playlists"
+    exit 1
+fi
+
+# Run the Python script
+echo "Running validate-playlists.py to check playlist entries..."
+if python3 "$PYTHON_SCRIPT" "$MOUNT_DIR" "${VALIDATE_ARGS[@]}"; then
+    echo "Playlist validation completed"
+else
+    echo "Some playlist entries point at tracks that are not on the card"
+    echo "Run $0 [device] copy to copy the missing albums from the NAS"
+    exit 1
+fi